@@ -0,0 +1,357 @@
+"""Benchmarks for the maze code. Run with: python bench.py maze|level|path|clone|rewind|endless|suite"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from maze import MAZE_GENERATORS, get_generator, make_grid, carve_loops, write_maze_file, MazeFile, CorridorGraph, HierarchicalPathfinder, grid_astar_path, DistanceField
+
+MAZE_SIZES = [125, 250, 500, 1000, 2000, 4000]
+PATH_SIZES = [25, 101, 251, 501, 1001, 2001]
+SUITE_SIZES = [25, 101, 251, 501] # 501x501 is past HPA_MIN_CELLS, so the suite covers both pathfinders
+SUITE_MODES = ["solo", "vs_ai", "hell"]
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+def build_maze(size, algorithm, seed):
+    rng = random.Random(seed)
+    grid = make_grid(size, size)
+    get_generator(algorithm).generate(grid, size, size, rng=rng)
+    loops = carve_loops(grid, size, size, (size * size) // 40, rng=rng)
+    return grid, loops, rng
+
+def random_queries(grid, rng, count):
+    open_cells = [(r, c) for r, row in enumerate(grid) for c, v in enumerate(row) if v == 0]
+    return [(rng.choice(open_cells), rng.choice(open_cells)) for _ in range(count)]
+
+def bench_maze(args):
+    print(f"{'algorithm':<12} {'size':>11} {'generate (s)':>13} {'loops (s)':>10} {'cells/s':>12}")
+    for name in args.algorithms:
+        generator = get_generator(name)
+        for size in args.sizes:
+            rng = random.Random(args.seed)
+            grid = make_grid(size, size)
+            t0 = time.perf_counter()
+            generator.generate(grid, size, size, rng=rng)
+            t1 = time.perf_counter()
+            carve_loops(grid, size, size, (size * size) // 40, rng=rng)
+            t2 = time.perf_counter()
+            print(f"{name:<12} {f'{size}x{size}':>11} {t1 - t0:>13.3f} {t2 - t1:>10.3f} {size * size / (t1 - t0):>12,.0f}")
+            del grid
+
+def bench_level(args):
+    print(f"{'size':>11} {'generate (s)':>13} {'save (s)':>9} {'load (s)':>9} {'file (KB)':>10}")
+    for size in args.sizes:
+        t0 = time.perf_counter()
+        grid, _, _ = build_maze(size, args.algorithm, args.seed)
+        t1 = time.perf_counter()
+        fd, path = tempfile.mkstemp(suffix=".maze"); os.close(fd)
+        try:
+            write_maze_file(path, grid, seed=args.seed)
+            t2 = time.perf_counter()
+            with MazeFile(path) as level: loaded = level.to_grid()
+            t3 = time.perf_counter()
+            assert loaded == grid, "level file did not round-trip"
+            print(f"{f'{size}x{size}':>11} {t1 - t0:>13.3f} {t2 - t1:>9.3f} {t3 - t2:>9.3f} {os.path.getsize(path) / 1024:>10,.0f}")
+        finally: os.remove(path)
+
+def check_patches(args):
+    """Regression check for CorridorGraph.patch: flip random cells one at a time and, after every patch, compare
+    path lengths with a graph built from scratch and with plain grid A*."""
+    size = args.patch_size; spent = 0.0
+    for seed in range(args.seed, args.seed + args.patch_seeds):
+        grid, loops, rng = build_maze(size, args.patch_algorithm, seed)
+        graph = CorridorGraph(grid, loops)
+        for i in range(args.patches):
+            r, c = rng.randrange(1, size - 1), rng.randrange(1, size - 1)
+            t0 = time.perf_counter(); graph.patch([(r, c, 1 - grid[r][c])]); spent += time.perf_counter() - t0
+            fresh = CorridorGraph([row[:] for row in grid], graph.extra_nodes)
+            for s, e in random_queries(grid, rng, 10):
+                lengths = len(graph.find_path(s, e)), len(fresh.find_path(s, e)), len(grid_astar_path(grid, s, e))
+                if len(set(lengths)) > 1:
+                    print(f"seed {seed}, patch {i + 1} ({r}, {c}): {s} -> {e} patched/fresh/grid lengths {lengths}"); sys.exit(1)
+    total = args.patches * args.patch_seeds
+    print(f"{total} random patches on {size}x{size} ({args.patch_seeds} seeds): paths match a fresh graph and grid A* "
+          f"({spent * 1e3 / max(1, total):.3f} ms/patch)\n")
+
+def bench_path(args):
+    if args.patches: check_patches(args)
+    print(f"{'size':>9} {'pathfinder':<16} {'build (ms)':>10} {'query (ms)':>10} {'expansions':>11} {'length':>7}")
+    for size in args.sizes:
+        grid, loops, rng = build_maze(size, args.algorithm, args.seed)
+        queries = random_queries(grid, rng, args.queries)
+        label = f"{size}x{size}"
+
+        def report(name, build_s, query_s, expansions, paths, exact):
+            ratio = sum(len(p) for p in paths) / max(1, sum(len(p) for p in exact))
+            print(f"{label:>9} {name:<16} {build_s * 1000:>10.1f} {query_s * 1000 / len(queries):>10.2f} {expansions / len(queries):>11,.0f} {ratio:>7.3f}")
+
+        t0 = time.perf_counter()
+        graph = CorridorGraph(grid, loops)
+        t1 = time.perf_counter()
+        exact = [graph.find_path(s, e) for s, e in queries]
+        t2 = time.perf_counter()
+
+        if size <= args.flat_max:
+            stats = {}
+            t3 = time.perf_counter()
+            flat = [grid_astar_path(grid, s, e, stats) for s, e in queries]
+            t4 = time.perf_counter()
+            assert [len(p) for p in flat] == [len(p) for p in exact], "corridor graph paths differ from grid A*"
+            report("grid A*", 0, t4 - t3, stats['expansions'], flat, exact)
+        report("corridor graph", t1 - t0, t2 - t1, graph.expansions, exact, exact)
+
+        t0 = time.perf_counter()
+        hpa = HierarchicalPathfinder(grid, args.cluster_size)
+        t1 = time.perf_counter()
+        routed = [hpa.find_path(s, e) for s, e in queries]
+        t2 = time.perf_counter()
+        report("HPA*", t1 - t0, t2 - t1, hpa.expansions, routed, exact)
+
+def bench_clone(args):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # The game module opens a window on import
+    import game
+    rng = random.Random(args.seed)
+    arrows = (game.INPUT_LEFT, game.INPUT_RIGHT, game.INPUT_UP, game.INPUT_DOWN)
+    print(f"{'mode':<7} {'clone (us)':>10} {'restore (us)':>12} {'sim frames/s':>13} {'rollouts/s':>11}")
+    for mode in ("vs_ai", "hell"):
+        state = game.GameState(25, mode, seed=args.seed)
+        for _ in range(10 * game.FPS): state.step(0) # Past the countdown, so rollouts do real work
+        t0 = time.perf_counter()
+        for _ in range(args.count): state.clone()
+        t1 = time.perf_counter()
+        snap = state.snapshot()
+        for _ in range(args.count): state.restore(snap)
+        t2 = time.perf_counter()
+        frames = 0
+        for _ in range(args.rollouts):
+            sim = state.clone()
+            for _ in range(args.horizon):
+                if not sim.game_active: break
+                sim.step(rng.choice(arrows)); frames += 1
+        t3 = time.perf_counter()
+        print(f"{mode:<7} {(t1 - t0) * 1e6 / args.count:>10.1f} {(t2 - t1) * 1e6 / args.count:>12.1f} {frames / (t3 - t2):>13,.0f} {args.rollouts / (t3 - t2):>11,.0f}")
+
+def bench_rewind(args):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import game
+    rng = random.Random(args.seed)
+    arrows = (game.INPUT_LEFT, game.INPUT_RIGHT, game.INPUT_UP, game.INPUT_DOWN)
+    print(f"{'mode':<7} {'frames':>7} {'memory (KB)':>12} {'KB/s':>7} {'step+record (us)':>17} {'back (us)':>10} {'forward (us)':>13}")
+    for mode in ("solo", "vs_ai", "hell"):
+        state = game.GameState(25, mode, seed=args.seed)
+        buffer = game.RewindBuffer(args.seconds)
+        frames = int(args.seconds * game.FPS) * 2
+        t0 = time.perf_counter()
+        for f in range(frames):
+            if mode == "hell": state.invincible_timer = 1 # Keep the run alive
+            state.step(rng.choice(arrows)); buffer.record(state)
+        t1 = time.perf_counter()
+        while buffer.step_back(state): pass
+        t2 = time.perf_counter()
+        while buffer.step_forward(state): pass
+        t3 = time.perf_counter()
+        stats = buffer.stats()
+        print(f"{mode:<7} {stats['frames']:>7} {stats['bytes'] / 1024:>12,.0f} {stats['bytes'] / 1024 / stats['seconds']:>7,.0f} "
+              f"{(t1 - t0) * 1e6 / frames:>17.0f} {(t2 - t1) * 1e6 / stats['frames']:>10.0f} {(t3 - t2) * 1e6 / stats['frames']:>13.0f}")
+
+def sealed_cells(grid):
+    """Open cells that can't walk to the bottom of the window, where an endless maze keeps going."""
+    bottom = [(r, c) for r in (len(grid) - 2, len(grid) - 1) for c, v in enumerate(grid[r]) if v == 0]
+    return sum(row.count(0) for row in grid) - len(DistanceField(grid, bottom).order)
+
+def bench_endless(args):
+    """Regression check for endless mode: after every scroll the whole window must still lead down."""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import game
+    print(f"{'seed':>5} {'windows':>8} {'depth':>7} {'sealed':>7} {'stuck':>6} {'scroll (ms)':>12}")
+    failed = False
+    for seed in range(args.seed, args.seed + args.seeds):
+        state = game.GameState(args.rows, "hell", endless=True, seed=seed)
+        state.warmup_timer = 1; state.step(0) # Past the countdown
+        windows = sealed = 0; stuck = False; spent = 0.0
+        while windows < args.windows:
+            # Jump to the deepest cell the player can walk to; if that doesn't scroll, they are trapped
+            state.invincible_timer = 1
+            field = state.player_field()
+            state.player_pos = list(max((divmod(i, field.cols) for i in field.order), key=lambda cell: cell[0]))
+            depth = state.depth
+            t0 = time.perf_counter(); state.step(0); spent += time.perf_counter() - t0
+            if state.depth == depth: stuck = True; break
+            windows += 1; sealed += sealed_cells(state.grid)
+        failed |= stuck or sealed > 0
+        print(f"{seed:>5} {windows:>8} {state.depth:>7} {sealed:>7} {'yes' if stuck else 'no':>6} {spent * 1e3 / max(1, windows):>12.3f}")
+    if failed: print("endless windows lost their way down"); sys.exit(1)
+
+# --- REGRESSION SUITE ---
+# Every metric is seconds per operation (lower is better), the best of a few repeats so a busy machine
+# reads as noise rather than as a regression.
+def best_of(repeats, run):
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter(); count = run(); best = min(best, (time.perf_counter() - t0) / count)
+    return best
+
+def scripted_inputs(seed, frames):
+    """Arrow runs of random length: it wanders like a player instead of jittering in place."""
+    rng = random.Random(seed)
+    arrows = (1, 2, 4, 8) # game.INPUT_LEFT..INPUT_DOWN, without importing the game here
+    bits = []
+    while len(bits) < frames: bits.extend([rng.choice(arrows)] * rng.randint(3, 30))
+    return bits[:frames]
+
+def measure_startup(repeats):
+    """Fresh interpreter to a loaded renderer: pygame init, the display, the asset loading."""
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1")
+    here = os.path.dirname(os.path.abspath(__file__))
+    def run():
+        subprocess.run([sys.executable, "-c", "import game; game.GameRenderer(game.screen)"], cwd=here, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return 1
+    return best_of(repeats, run)
+
+def run_suite(args):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy"); os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import game
+    metrics = {}
+    def record(name, seconds):
+        metrics[name] = seconds
+        print(f"{name:<24} {seconds * 1e3:>12.4f} ms", flush=True)
+
+    record("startup", measure_startup(args.repeats))
+
+    for size in args.sizes:
+        state = game.GameState(size, "solo", cols=size, seed=args.seed)
+        def generate():
+            state.rng.seed(args.seed); state._init_grid(); state._generate_maze(1, 1); state._create_loops(); state.grid_version += 1
+            return 1
+        record(f"generate/{size}", best_of(args.repeats, generate))
+        queries = random_queries(state.grid, random.Random(args.seed), args.queries)
+        state.get_astar_path(*queries[0]) # Build the corridor graph / HPA* layer outside the timing
+        record(f"astar/{size}", best_of(args.repeats, lambda: [state.get_astar_path(s, e) for s, e in queries] and len(queries)))
+
+    renderer = game.GameRenderer(game.screen)
+    inputs = scripted_inputs(args.seed, args.frames)
+    for mode in SUITE_MODES:
+        start = game.GameState(25, mode, seed=args.seed)
+        start.warmup_timer = 1 # Time the game, not the countdown
+        def play():
+            state = start.clone()
+            for bits in inputs:
+                if not state.game_active or state.game_won: state = start.clone()
+                state.step(bits)
+            return len(inputs)
+        record(f"step/{mode}", best_of(args.repeats, play))
+
+        state = start.clone()
+        for bits in inputs[:10 * game.FPS]: state.step(bits)
+        def init_level():
+            renderer.init_level(state); return 1
+        record(f"init_level/{mode}", best_of(args.repeats, init_level))
+        def draw():
+            for _ in range(args.draws): renderer.draw_game(state)
+            return args.draws
+        record(f"draw_game/{mode}", best_of(args.repeats, draw))
+    return metrics
+
+def compare(baseline, metrics, threshold):
+    """Prints current against baseline per metric. Returns the names that got slower by more than threshold."""
+    print(f"\n{'metric':<24} {'baseline (ms)':>14} {'now (ms)':>12} {'change':>8}")
+    regressed = []
+    for name, now in metrics.items():
+        before = baseline.get(name)
+        if before is None: print(f"{name:<24} {'-':>14} {now * 1e3:>12.4f} {'new':>8}"); continue
+        change = now / before - 1
+        flag = ""
+        if change > threshold: regressed.append(name); flag = "  REGRESSED"
+        print(f"{name:<24} {before * 1e3:>14.4f} {now * 1e3:>12.4f} {change:>+8.1%}{flag}")
+    return regressed
+
+def bench_suite(args):
+    if args.quick: args.sizes, args.frames, args.draws, args.repeats = args.sizes[:2], args.frames // 5, args.draws // 5, 2
+    metrics = run_suite(args)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f: baseline = json.load(f)
+    if baseline is None or args.update:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "metrics": metrics}, f, indent=2, sort_keys=True)
+        print(f"\nbaseline written to {args.baseline}")
+        return
+    regressed = compare(baseline["metrics"], metrics, args.threshold)
+    if regressed:
+        print(f"\n{len(regressed)} metric(s) regressed by more than {args.threshold:.0%}: {', '.join(regressed)}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    maze_p = sub.add_parser("maze", help="maze generation time versus grid size")
+    maze_p.add_argument("--algorithms", nargs="+", default=list(MAZE_GENERATORS), choices=list(MAZE_GENERATORS))
+    maze_p.add_argument("--sizes", nargs="+", type=int, default=MAZE_SIZES)
+    maze_p.add_argument("--seed", type=int, default=1)
+    maze_p.set_defaults(func=bench_maze)
+
+    level_p = sub.add_parser("level", help="level file save/load time versus generating the maze")
+    level_p.add_argument("--algorithm", default="backtracker", choices=list(MAZE_GENERATORS))
+    level_p.add_argument("--sizes", nargs="+", type=int, default=MAZE_SIZES)
+    level_p.add_argument("--seed", type=int, default=1)
+    level_p.set_defaults(func=bench_level)
+
+    path_p = sub.add_parser("path", help="pathfinding query latency and node expansions versus maze size")
+    path_p.add_argument("--algorithm", default="backtracker", choices=list(MAZE_GENERATORS))
+    path_p.add_argument("--sizes", nargs="+", type=int, default=PATH_SIZES)
+    path_p.add_argument("--queries", type=int, default=50)
+    path_p.add_argument("--cluster-size", type=int, default=16)
+    path_p.add_argument("--flat-max", type=int, default=501, help="skip plain grid A* above this size")
+    path_p.add_argument("--patches", type=int, default=200, help="random single-cell patches to check first; 0 skips the check")
+    path_p.add_argument("--patch-size", type=int, default=25)
+    path_p.add_argument("--patch-seeds", type=int, default=5)
+    path_p.add_argument("--patch-algorithm", default="wilson", choices=list(MAZE_GENERATORS),
+                        help="wilson mazes branch often, so random flips close corridors back onto their own junction")
+    path_p.add_argument("--seed", type=int, default=1)
+    path_p.set_defaults(func=bench_path)
+
+    clone_p = sub.add_parser("clone", help="GameState clone/restore cost and lookahead rollout throughput")
+    clone_p.add_argument("--count", type=int, default=5000)
+    clone_p.add_argument("--rollouts", type=int, default=500)
+    clone_p.add_argument("--horizon", type=int, default=60, help="frames per rollout")
+    clone_p.add_argument("--seed", type=int, default=1)
+    clone_p.set_defaults(func=bench_clone)
+
+    rewind_p = sub.add_parser("rewind", help="rewind buffer memory and step cost per mode")
+    rewind_p.add_argument("--seconds", type=float, default=10)
+    rewind_p.add_argument("--seed", type=int, default=1)
+    rewind_p.set_defaults(func=bench_rewind)
+
+    endless_p = sub.add_parser("endless", help="scroll endless windows and fail if any open cell is cut off from the bottom")
+    endless_p.add_argument("--rows", type=int, default=25)
+    endless_p.add_argument("--windows", type=int, default=500, help="scrolls per seed")
+    endless_p.add_argument("--seeds", type=int, default=4)
+    endless_p.add_argument("--seed", type=int, default=1)
+    endless_p.set_defaults(func=bench_endless)
+
+    suite_p = sub.add_parser("suite", help="headless regression suite checked against a JSON baseline (exits 1 on a regression)")
+    suite_p.add_argument("--baseline", default=BASELINE, help="baseline file; written on the first run or with --update")
+    suite_p.add_argument("--update", action="store_true", help="overwrite the baseline with this run")
+    suite_p.add_argument("--threshold", type=float, default=0.25, help="fail when a metric is this fraction slower than the baseline")
+    suite_p.add_argument("--sizes", nargs="+", type=int, default=SUITE_SIZES)
+    suite_p.add_argument("--queries", type=int, default=50)
+    suite_p.add_argument("--frames", type=int, default=3000, help="scripted frames per mode")
+    suite_p.add_argument("--draws", type=int, default=100, help="draw_game calls per repeat")
+    suite_p.add_argument("--repeats", type=int, default=3)
+    suite_p.add_argument("--quick", action="store_true", help="smaller sizes and fewer frames, for a smoke run")
+    suite_p.add_argument("--seed", type=int, default=1)
+    suite_p.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
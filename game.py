@@ -1,8 +1,15 @@
 import pygame
 import sys
-import heapq
 import random
 import math
+import struct
+import time
+import zlib
+from sys import getsizeof
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from maze import MAZE_GENERATORS, get_generator, make_grid, carve_loops, MazeStream, MazeFile, write_maze_file, CorridorGraph, HierarchicalPathfinder, DistanceField, ReservationTable, cooperative_search, VisibilityCache
 
 # --- SETUP PYGAME FIRST TO GET SCREEN SIZE ---
 pygame.init()
@@ -14,12 +21,42 @@ SCREEN_HEIGHT = info.current_h
 
 # Set Fullscreen Mode
 screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.FULLSCREEN)
+display = screen # The monitor; `screen` is whatever the game draws into, which can be a smaller logical canvas
+display_target = None # Where on the monitor a logical canvas gets scaled to
 pygame.display.set_caption("Mabrook's Maze: Nether Update")
 clock = pygame.time.Clock()
 
+def set_logical_resolution(width, height, integer_scale=False):
+    """Draws everything at width x height instead of the monitor's native size, so fill rate and surface memory
+    stop growing with the display. SCREEN_WIDTH/SCREEN_HEIGHT become the logical size, so all layout math
+    follows. pygame.SCALED does the upscale on the GPU; integer_scale (or a driver without SCALED) keeps a
+    software canvas that present() blows up by the largest whole factor that fits, letterboxed."""
+    global screen, display, display_target, SCREEN_WIDTH, SCREEN_HEIGHT
+    SCREEN_WIDTH, SCREEN_HEIGHT = width, height
+    if not integer_scale:
+        try:
+            screen = display = pygame.display.set_mode((width, height), pygame.SCALED | pygame.FULLSCREEN); display_target = None
+            return screen
+        except pygame.error: pass # No accelerated renderer, fall back to scaling in software
+    dw, dh = display.get_size()
+    factor = min(dw // width, dh // height)
+    size = (width * factor, height * factor) if factor else (min(dw, width * dh // height), min(dh, height * dw // width))
+    display.fill(BLACK)
+    display_target = display.subsurface(((dw - size[0]) // 2, (dh - size[1]) // 2) + size)
+    screen = pygame.Surface((width, height)).convert()
+    return screen
+
+def present():
+    """Puts the finished frame on the monitor, upscaling the logical canvas once if there is one."""
+    if display_target is not None: pygame.transform.scale(screen, display_target.get_size(), display_target)
+    pygame.display.flip()
+
 # --- CONFIGURATION ---
 UI_HEIGHT = 80
 FPS = 30 
+HPA_MIN_CELLS = 250_000 # Mazes this big route over HPA* chunks instead of the exact corridor graph
+LOOKAHEAD_BUDGET = 180 # Simulated frames the lookahead VS bot may run per real frame, a few ms of thinking
+FOG_RADIUS = 8 # How far anyone sees down a corridor with fog of war on
 
 # --- COLORS ---
 WHITE = (255, 255, 255)
@@ -40,6 +77,7 @@ CREEPER_AURA = (0, 0, 0, 100)
 EXPLOSION_MARK = (10, 0, 0, 180)
 ENDERMAN_PURPLE = (148, 0, 211)
 GHAST_SHADOW = (0, 0, 0, 100)
+FOG_COLOR = (0, 0, 0, 235)
 INVINCIBLE_GOLD = (255, 215, 0)
 BUTTON_COLOR = (50, 50, 50)
 BUTTON_BORDER = (20, 20, 20)
@@ -55,6 +93,24 @@ RED_HEART = (255, 0, 0)
 GOLD_KEY = (255, 215, 0)
 PEARL_COLOR = (0, 255, 200)
 
+# Level file codes (append only, the numbers are stored on disk)
+LEVEL_MODES = ("solo", "vs_ai", "hell")
+LEVEL_REWARD_TYPES = ('points', 'swiftness', 'slowness', 'pearl', 'energy_drink')
+LEVEL_OPPONENTS = ("greedy", "lookahead", "remote")
+LEVEL_FLAG_FOG = 1
+REPLAY_FLAG_ENDLESS, REPLAY_FLAG_FOG = 1, 2 # The flags byte used to hold just the endless bool
+# Per-frame input bits: held arrows in the low nibble, one-shot key presses above
+INPUT_LEFT, INPUT_RIGHT, INPUT_UP, INPUT_DOWN = 1, 2, 4, 8
+INPUT_PAUSE, INPUT_PEARL, INPUT_DRINK = 16, 32, 64
+
+ENTITY_PLAYER, ENTITY_GOAL, ENTITY_BOT, ENTITY_CREEPER, ENTITY_REWARD, ENTITY_BOMB, ENTITY_KEY, ENTITY_HEART, ENTITY_INVENTORY = range(9)
+# ENTITY_INVENTORY variant bits: what the player holds and which one-off items already appeared
+HELD_KEY, HELD_SHIELD, HELD_DRINK, KEY_SPAWNED, HEART_SPAWNED = 1, 2, 4, 8, 16
+
+def reward_color(rew_type, val):
+    if rew_type == 'points': return {20: PURPLE, 10: ORANGE}.get(val, PINK)
+    return {'pearl': PEARL_COLOR, 'slowness': BROWN_POTION}.get(rew_type, CYAN_POTION)
+
 class MenuState:
     """THE FACE: Handles the Main Menu logic, animations, and input."""
     def __init__(self):
@@ -68,6 +124,8 @@ class MenuState:
             "Hard (25 Rows)", 
             "VS AI (25 Rows)", 
             "HELL MODE (25 Rows)",
+            "ENDLESS HELL",
+            "HELL IN THE DARK",
             "Quit Game"
         ]
         self.selected_index = 0
@@ -125,18 +183,36 @@ class MenuState:
 
 class GameState:
     """THE BRAIN: Handles all logic, rules, AI moving, and grid management."""
-    def __init__(self, rows, mode):
+    def __init__(self, rows, mode, cols=None, generator="backtracker", endless=False, seed=None, grid=None, opponent="greedy", fog=False, lookahead_budget=LOOKAHEAD_BUDGET):
         self.mode = mode 
+        self.endless = endless
+        self.fog = fog
+        # Every random draw goes through self.rng, so a seed reproduces the whole level
+        self.seed = seed if seed is not None else random.randrange(2**63)
+        self.rng = random.Random(self.seed)
         
-        # DYNAMIC GRID SIZING
+        # DYNAMIC GRID SIZING (cols can be forced for headless / oversized mazes)
+        if grid is not None: rows, cols = len(grid), len(grid[0])
         self.rows = rows
         available_height = SCREEN_HEIGHT - UI_HEIGHT
-        self.cell_size = available_height // self.rows
-        self.cols = SCREEN_WIDTH // self.cell_size
-        if self.cols % 2 == 0: self.cols -= 1
-        if self.rows % 2 == 0: self.rows -= 1 
+        self.cell_size = max(1, available_height // self.rows)
+        self.cols = cols if cols is not None else SCREEN_WIDTH // self.cell_size
+        if grid is None:
+            if self.cols % 2 == 0: self.cols -= 1
+            if self.rows % 2 == 0: self.rows -= 1 
         
+        self.maze_generator = get_generator(generator)
+        self.maze_stream = None
         self.grid = []
+        self.grid_version = 0
+        self.loop_cells = []
+        self.depth = 0
+        self._corridor_graph = None
+        self._corridor_graph_version = 0
+        self._hierarchical = None
+        self._fields = {} # name -> (key, DistanceField)
+        self.field_cache = None # Optional FieldCache shared with other games on the same grid
+        self.visibility = VisibilityCache(FOG_RADIUS) if fog else None # Line of sight per cell, only with fog of war
         self.path_taken = []
         self.player_last_dir = (0, 0) 
         
@@ -180,6 +256,10 @@ class GameState:
         self.user_score = 0
         self.rewards = [] 
         self.bots = []
+        self.next_bot_id = 0
+        self.bot_planner = BotPlanner()
+        self.opponent_kind = opponent if mode == "vs_ai" else "greedy"
+        self.opponent = LookaheadOpponent(self.seed, budget=lookahead_budget) if self.opponent_kind == "lookahead" else None
         self.bombs = []
         self.creepers = [] 
         self.ghasts = [] 
@@ -192,23 +272,30 @@ class GameState:
         self.ai_path_display = []
         self.ai_draw_index = 0
         
-        # Countdown Logic
-        self.start_ticks = pygame.time.get_ticks()
-        self.warmup_duration = 3000 if mode == "hell" else 5000
+        # Countdown Logic (counted in frames so replays and headless runs stay deterministic)
+        self.warmup_timer = (3 if mode == "hell" else 5) * FPS
         self.is_warming_up = True if mode in ["vs_ai", "hell"] else False
 
-        # 1. Initialize & Generate
-        self._init_grid()
-        self._generate_maze(1, 1)
-        self._create_loops()
+        # 1. Initialize & Generate (endless mazes stream in row by row, loaded ones arrive finished)
+        if grid is not None:
+            self.grid = grid
+        elif self.endless:
+            self.maze_stream = MazeStream(self.cols, self.rng)
+            self.grid = self.maze_stream.take(self.rows)
+            self._create_loops()
+        else:
+            self._init_grid()
+            self._generate_maze(1, 1)
+            self._create_loops()
         
         # 2. Set Start/End
         self.player_pos = [1, 1]
-        self.grid[1][1] = 0
+        self.set_cell(1, 1, 0)
         self.path_taken.append(tuple(self.player_pos))
         
         self.goal_pos = [self.rows - 2, self.cols - 2]
-        if self.grid[self.goal_pos[0]][self.goal_pos[1]] == 1:
+        if self.endless: self.goal_pos = [-1, -1] # No portal, just keep running
+        elif self.grid[self.goal_pos[0]][self.goal_pos[1]] == 1:
              found = False
              for r in range(self.rows - 2, 0, -1):
                  for c in range(self.cols - 2, 0, -1):
@@ -221,45 +308,178 @@ class GameState:
         # 3. Setup Mode Specifics
         self._setup_entities()
 
+    def digest(self):
+        """Checksum of the outcome-relevant state, used to spot replays that no longer play out the same way."""
+        summary = (self.player_pos, self.user_score, self.game_time, self.game_active, self.game_won, self.game_over_text,
+                   [b['pos'] for b in self.bots], [r['pos'] for r in self.rewards], self.depth)
+        return zlib.crc32(repr(summary).encode())
+
+    # --- SAVE / LOAD ---
+    def save(self, path):
+        """Writes the maze and its entities to a compact binary level file (see maze.py for the layout)."""
+        if self.endless: raise ValueError("Endless levels stream their rows and can't be saved")
+        entities = [(ENTITY_PLAYER, 0, self.user_score, self.player_pos[0], self.player_pos[1], 0, 0),
+                    (ENTITY_GOAL, 0, 0, self.goal_pos[0], self.goal_pos[1], 0, 0)]
+        for b in self.bots: entities.append((ENTITY_BOT, 0, b.get('score', 0), b['pos'][0], b['pos'][1], 0, 0))
+        for c in self.creepers: entities.append((ENTITY_CREEPER, c['axis'], 0, c['pos'][0], c['pos'][1], c['start_pos'][0], c['start_pos'][1]))
+        for rew in self.rewards: entities.append((ENTITY_REWARD, LEVEL_REWARD_TYPES.index(rew['type']), rew['val'], rew['pos'][0], rew['pos'][1], 0, 0))
+        for b in self.bombs: entities.append((ENTITY_BOMB, 0, b['timer'], b['pos'][0], b['pos'][1], 0, 0))
+        if self.key_pos: entities.append((ENTITY_KEY, 0, 0, self.key_pos[0], self.key_pos[1], 0, 0))
+        if self.heart_pos: entities.append((ENTITY_HEART, 0, 0, self.heart_pos[0], self.heart_pos[1], 0, 0))
+        held = (HELD_KEY * self.has_key | HELD_SHIELD * self.has_shield | HELD_DRINK * self.has_energy_drink
+                | KEY_SPAWNED * self.key_spawned | HEART_SPAWNED * self.heart_spawned)
+        entities.append((ENTITY_INVENTORY, held, self.game_time, self.pearl_count, 0, 0, 0))
+        write_maze_file(path, self.grid, LEVEL_MODES.index(self.mode), LEVEL_FLAG_FOG if self.fog else 0, self.seed, entities)
+
+    @classmethod
+    def load(cls, path):
+        """Restores a saved game, inventory and clock included. The grid is copied out of the mapped file into
+        lists, since play edits it; only MazeFile.cell reads the mapping without copying."""
+        with MazeFile(path) as level:
+            state = cls(level.rows, LEVEL_MODES[level.mode], cols=level.cols, seed=level.seed, grid=level.to_grid(), fog=bool(level.flags & LEVEL_FLAG_FOG))
+            entities = level.entities
+        # The saved entity table replaces whatever _setup_entities rolled
+        state.bots, state.creepers, state.rewards, state.bombs = [], [], [], []
+        state.pearl_on_map = state.drink_on_map = False
+        for kind, variant, value, r, c, r2, c2 in entities:
+            if kind == ENTITY_PLAYER: state.player_pos = [r, c]; state.user_score = value; state.path_taken = [(r, c)]
+            elif kind == ENTITY_GOAL: state.goal_pos = [r, c]
+            elif kind == ENTITY_BOT: state.bots.append(state._new_bot([r, c], value))
+            elif kind == ENTITY_CREEPER: state.creepers.append(state._new_creeper([r, c], variant, [r2, c2]))
+            elif kind == ENTITY_REWARD:
+                rew_type = LEVEL_REWARD_TYPES[variant]
+                if rew_type == 'pearl': state.pearl_on_map = True
+                elif rew_type == 'energy_drink': state.drink_on_map = True
+                state.rewards.append({'pos': (r, c), 'type': rew_type, 'color': reward_color(rew_type, value), 'val': value})
+            elif kind == ENTITY_BOMB: state.bombs.append({'pos': (r, c), 'timer': value})
+            elif kind == ENTITY_KEY: state.key_pos = (r, c); state.key_spawned = True
+            elif kind == ENTITY_HEART: state.heart_pos = (r, c); state.heart_spawned = True
+            elif kind == ENTITY_INVENTORY:
+                state.has_key, state.has_shield, state.has_energy_drink = bool(variant & HELD_KEY), bool(variant & HELD_SHIELD), bool(variant & HELD_DRINK)
+                state.key_spawned = state.key_spawned or bool(variant & KEY_SPAWNED); state.heart_spawned = state.heart_spawned or bool(variant & HEART_SPAWNED)
+                state.game_time, state.pearl_count = value, r
+        return state
+
+    # --- SNAPSHOTS ---
+    # The maze, the pathfinding caches and the reward dicts are never edited in place during play, so snapshots
+    # and clones share them and copy only the entity containers and timers that update() does mutate.
+    @staticmethod
+    def _copy_mutable(state):
+        state['player_pos'] = list(state['player_pos'])
+        state['path_taken'] = list(state['path_taken'])
+        state['rewards'] = list(state['rewards'])
+        state['explosion_marks'] = list(state['explosion_marks'])
+        state['_fields'] = dict(state['_fields'])
+        state['bots'] = [dict(b, pos=list(b['pos']), path=list(b['path'])) for b in state['bots']]
+        state['creepers'] = [dict(c, pos=list(c['pos']), start_pos=list(c['start_pos'])) for c in state['creepers']]
+        state['bombs'] = [dict(b) for b in state['bombs']]
+        state['ghasts'] = [dict(g) for g in state['ghasts']]
+        state['fire_charges'] = [{'pos': list(fc['pos']), 'velocity': fc['velocity']} for fc in state['fire_charges']]
+        if state['enderman']: state['enderman'] = dict(state['enderman'], pos=list(state['enderman']['pos']))
+        state['bot_planner'] = state['bot_planner'].copy()
+        if state['opponent']: state['opponent'] = state['opponent'].copy()
+        return state
+
+    def snapshot(self):
+        """Captures the game for restore(). The rng is stored as its state tuple."""
+        if self.endless: raise ValueError("Endless levels stream their rows and can't be snapshotted")
+        snap = self._copy_mutable(self.__dict__.copy())
+        snap['rng'] = self.rng.getstate()
+        return snap
+
+    def restore(self, snap):
+        """Rewinds to a snapshot. The snapshot is left untouched, so it can be restored again."""
+        rng = self.rng
+        self.__dict__.update(self._copy_mutable(dict(snap)))
+        self.rng = rng; rng.setstate(snap['rng'])
+
+    def clone(self):
+        """An independent copy to simulate ahead on, a few microseconds instead of a deepcopy of the maze."""
+        if self.endless: raise ValueError("Endless levels stream their rows and can't be cloned")
+        twin = object.__new__(type(self))
+        twin.__dict__ = self._copy_mutable(self.__dict__.copy())
+        twin.rng = random.Random(0); twin.rng.setstate(self.rng.getstate())
+        return twin
+
     def _init_grid(self):
-        for r in range(self.rows):
-            row = []
-            for c in range(self.cols): row.append(1) 
-            self.grid.append(row)
+        self.grid = make_grid(self.rows, self.cols)
 
     def _generate_maze(self, start_r, start_c):
-        stack = [(start_r, start_c)]
-        self.grid[start_r][start_c] = 0
-        while stack:
-            current_r, current_c = stack[-1]
-            directions = [(0, 2), (0, -2), (2, 0), (-2, 0)]
-            random.shuffle(directions)
-            found_neighbor = False
-            for dr, dc in directions:
-                nr, nc = current_r + dr, current_c + dc
-                if 0 < nr < self.rows - 1 and 0 < nc < self.cols - 1 and self.grid[nr][nc] == 1:
-                    self.grid[current_r + dr // 2][current_c + dc // 2] = 0
-                    self.grid[nr][nc] = 0
-                    stack.append((nr, nc))
-                    found_neighbor = True
-                    break 
-            if not found_neighbor: stack.pop()
+        self.maze_generator.generate(self.grid, self.rows, self.cols, start_r, start_c, self.rng)
 
     def _create_loops(self):
-        num_walls_to_remove = (self.rows * self.cols) // 20 
-        for _ in range(num_walls_to_remove):
-            r = random.randint(1, self.rows - 2)
-            c = random.randint(1, self.cols - 2)
-            if self.grid[r][c] == 1: self.grid[r][c] = 0
+        # The old random knock-outs opened about rows*cols/40 wall cells, pillars included.
+        # Open as many, but only walls that sit between two corridors.
+        num_walls_to_remove = (self.rows * self.cols) // 40
+        self.loop_cells = carve_loops(self.grid, self.rows, self.cols, num_walls_to_remove, self.rng)
+
+    def _scroll_window(self, count):
+        """Endless mode: drop `count` rows behind the player, stream in new ones and shift everything up."""
+        del self.grid[:count]
+        self.grid.extend(self.maze_stream.take(count))
+        # A pocket whose only way out ran through the dropped rows would be sealed off for good, so the new
+        # top row becomes a corridor standing in for everything above it
+        self.grid[0][1:-1] = [0] * (self.cols - 2)
+        self.depth += count
+        self.grid_version += 1
+        self._fields.clear() # Every field belongs to the old window now
+
+        def keep(pos): return pos[0] - count >= 0
+        def up(pos): return (pos[0] - count, pos[1])
+
+        self.player_pos = [self.player_pos[0] - count, self.player_pos[1]]
+        self.path_taken = [up(p) for p in self.path_taken if keep(p)]
+        self.loop_cells = [up(p) for p in self.loop_cells if keep(p)]
+        self.explosion_marks = [up(p) for p in self.explosion_marks if keep(p)]
+        self.bombs = [dict(b, pos=up(b['pos'])) for b in self.bombs if keep(b['pos'])]
+
+        for rew in self.rewards:
+            if not keep(rew['pos']):
+                if rew['type'] == 'pearl': self.pearl_on_map = False
+                elif rew['type'] == 'energy_drink': self.drink_on_map = False
+        self.rewards = [dict(rew, pos=up(rew['pos'])) for rew in self.rewards if keep(rew['pos'])]
+        if self.key_pos: self.key_pos = up(self.key_pos) if keep(self.key_pos) else None
+        if self.heart_pos: self.heart_pos = up(self.heart_pos) if keep(self.heart_pos) else None
+
+        self.bot_planner.reset()
+        self.bots = [b for b in self.bots if keep(b['pos'])]
+        for b in self.bots:
+            b['pos'] = list(up(b['pos'])); b['path'] = []
+        self.creepers = [c for c in self.creepers if keep(c['pos'])]
+        for c in self.creepers:
+            c['pos'] = list(up(c['pos'])); c['start_pos'] = list(up(c['start_pos']))
+        if self.enderman:
+            if keep(self.enderman['pos']): self.enderman['pos'] = list(up(self.enderman['pos']))
+            else: self.enderman = None
+        for g in self.ghasts:
+            for key in ('p0', 'p1', 'p2', 'pos'): g[key] = (g[key][0] - count, g[key][1])
+        for fc in self.fire_charges: fc['pos'][0] -= count
+
+        # Fresh rows get their own loops, then the window is topped back up
+        new_loops = carve_loops(self.grid, self.rows, self.cols, (count * self.cols) // 40, self.rng, r_min=self.rows - count - 1)
+        self.loop_cells.extend(new_loops)
+        if len(self.rewards) < 7: self._generate_rewards(7 - len(self.rewards))
+        if not self.bots: self.spawn_hell_bot()
+        if not self.creepers: self.spawn_creeper()
+
+    def _new_bot(self, pos, score=0):
+        self.next_bot_id += 1
+        if self.mode == "vs_ai" and self.opponent_kind == "remote": # Player two, steered like the player through step()
+            return {'pos': pos, 'path': [], 'timer': 0, 'state': 'REMOTE', 'base_speed': self.base_move_delay, 'speed': self.base_move_delay, 'score': score, 'id': self.next_bot_id, 'move_timer': 0}
+        if self.mode == "vs_ai": return {'pos': pos, 'path': [], 'timer': 0, 'state': 'THINKING', 'base_speed': 8, 'speed': 8, 'score': score, 'id': self.next_bot_id}
+        return {'pos': pos, 'path': [], 'timer': 0, 'state': 'CHASING', 'base_speed': 11, 'speed': 11, 'repath_timer': 0, 'id': self.next_bot_id}
+
+    def _new_creeper(self, pos, axis, start_pos=None):
+        return {'pos': pos, 'axis': axis, 'dir': 1, 'start_pos': start_pos or list(pos), 'range': 10, 'timer': 0, 'speed': 15, 'fuse': 90, 'radius': 3, 'state': 'PATROL', 'blink_timer': 0}
 
     def _setup_entities(self):
         if self.mode == "vs_ai":
-            self.bots.append({'pos': [1, 1], 'path': [], 'timer': 0, 'state': 'THINKING', 'base_speed': 8, 'speed': 8, 'score': 0})
+            self.bots.append(self._new_bot([1, 1]))
             self._generate_rewards(5)
         elif self.mode == "hell":
             start_r, start_c = 1, self.cols - 2
             while self.grid[start_r][start_c] == 1 and start_c > 0: start_c -= 1
-            self.bots.append({'pos': [start_r, start_c], 'path': [], 'timer': 0, 'state': 'CHASING', 'base_speed': 11, 'speed': 11, 'repath_timer': 0, 'id': 0})
+            self.bots.append(self._new_bot([start_r, start_c]))
             self._generate_rewards(7) 
             self.spawn_creeper() 
 
@@ -275,8 +495,8 @@ class GameState:
         attempts = 0
         while added < count and attempts < 1000:
             attempts += 1
-            r = random.randint(1, self.rows - 2)
-            c = random.randint(1, self.cols - 2)
+            r = self.rng.randint(1, self.rows - 2)
+            c = self.rng.randint(1, self.cols - 2)
             if self.grid[r][c] == 0:
                 pos = (r, c)
                 collision = False
@@ -286,10 +506,10 @@ class GameState:
                 for rew in self.rewards: 
                     if rew['pos'] == pos: collision = True
                 if not collision:
-                    rew_type = random.choices(choices, weights=weights, k=1)[0]
+                    rew_type = self.rng.choices(choices, weights=weights, k=1)[0]
                     if rew_type == 'points':
                         pt_types = [{'color': PURPLE, 'val': 20}, {'color': ORANGE, 'val': 10}, {'color': PINK, 'val': 5}]
-                        data = random.choice(pt_types)
+                        data = self.rng.choice(pt_types)
                         self.rewards.append({'pos': pos, 'type': 'points', 'color': data['color'], 'val': data['val']})
                     else:
                         color = CYAN_POTION if rew_type == 'swiftness' else BROWN_POTION
@@ -298,8 +518,8 @@ class GameState:
 
     def spawn_specific_item(self, item_type):
         for _ in range(100):
-            r = random.randint(1, self.rows - 2)
-            c = random.randint(1, self.cols - 2)
+            r = self.rng.randint(1, self.rows - 2)
+            c = self.rng.randint(1, self.cols - 2)
             pos = (r, c)
             if self.grid[r][c] == 0 and pos != tuple(self.player_pos) and pos != tuple(self.goal_pos):
                 collision = False
@@ -326,49 +546,41 @@ class GameState:
 
     def spawn_heart(self):
         for _ in range(50):
-            r = random.randint(1, self.rows - 2)
-            c = random.randint(1, self.cols - 2)
+            r = self.rng.randint(1, self.rows - 2)
+            c = self.rng.randint(1, self.cols - 2)
             if self.grid[r][c] == 0 and (r,c) != tuple(self.player_pos):
                 self.heart_pos = (r, c)
                 self.heart_spawned = True
                 return
 
     def spawn_hell_bot(self):
-        for _ in range(50):
-            r = random.randint(1, self.rows - 2)
-            c = random.randint(1, self.cols - 2)
-            if self.grid[r][c] == 0:
-                dist = abs(r - self.player_pos[0]) + abs(c - self.player_pos[1])
-                if dist > 15:
-                    self.bots.append({'pos': [r, c], 'path': [], 'timer': 0, 'state': 'CHASING', 'base_speed': 11, 'speed': 11, 'repath_timer': 0, 'id': len(self.bots)})
-                    return
+        cells = self.player_field().cells_at_least(16)
+        if cells: self.bots.append(self._new_bot(list(self.rng.choice(cells))))
 
     def spawn_creeper(self):
         for _ in range(50):
-            r = random.randint(1, self.rows - 2)
-            c = random.randint(1, self.cols - 2)
+            r = self.rng.randint(1, self.rows - 2)
+            c = self.rng.randint(1, self.cols - 2)
             if self.grid[r][c] == 0 and (r,c) != tuple(self.player_pos):
-                axis = random.choice([0, 1])
-                self.creepers.append({'pos': [r, c], 'axis': axis, 'dir': 1, 'start_pos': [r, c], 'range': 10, 'timer': 0, 'speed': 15, 'fuse': 90, 'radius': 3, 'state': 'PATROL', 'blink_timer': 0})
+                axis = self.rng.choice([0, 1])
+                self.creepers.append(self._new_creeper([r, c], axis))
                 return
 
     def spawn_enderman(self):
-        for _ in range(50):
-            r = random.randint(1, self.rows - 2)
-            c = random.randint(1, self.cols - 2)
-            if self.grid[r][c] == 0 and (abs(r - self.player_pos[0]) + abs(c - self.player_pos[1]) > 5):
-                self.enderman = {'pos': [r, c], 'duration': 10 * FPS, 'teleport_timer': 0, 'teleport_interval': int(1.5 * FPS)}
-                return
+        cells = self.player_field().cells_at_least(6)
+        if cells:
+            r, c = self.rng.choice(cells)
+            self.enderman = {'pos': [r, c], 'duration': 10 * FPS, 'teleport_timer': 0, 'teleport_interval': int(1.5 * FPS)}
 
     def spawn_ghast(self):
-        side = random.randint(0, 3)
-        if side == 0: start = (-5, random.randint(0, self.cols)); end = (self.rows + 5, random.randint(0, self.cols))
-        elif side == 1: start = (random.randint(0, self.rows), self.cols + 5); end = (random.randint(0, self.rows), -5)
-        elif side == 2: start = (self.rows + 5, random.randint(0, self.cols)); end = (-5, random.randint(0, self.cols))
-        else: start = (random.randint(0, self.rows), -5); end = (random.randint(0, self.rows), self.cols + 5)
+        side = self.rng.randint(0, 3)
+        if side == 0: start = (-5, self.rng.randint(0, self.cols)); end = (self.rows + 5, self.rng.randint(0, self.cols))
+        elif side == 1: start = (self.rng.randint(0, self.rows), self.cols + 5); end = (self.rng.randint(0, self.rows), -5)
+        elif side == 2: start = (self.rows + 5, self.rng.randint(0, self.cols)); end = (-5, self.rng.randint(0, self.cols))
+        else: start = (self.rng.randint(0, self.rows), -5); end = (self.rng.randint(0, self.rows), self.cols + 5)
         mid_r, mid_c = self.rows // 2, self.cols // 2
-        control = (mid_r + random.randint(-10, 10), mid_c + random.randint(-10, 10))
-        self.ghasts.append({'p0': start, 'p1': control, 'p2': end, 't': 0.0, 'speed': 0.0015, 'pos': start, 'shoot_timer': random.randint(90, 120)})
+        control = (mid_r + self.rng.randint(-10, 10), mid_c + self.rng.randint(-10, 10))
+        self.ghasts.append({'p0': start, 'p1': control, 'p2': end, 't': 0.0, 'speed': 0.0015, 'pos': start, 'shoot_timer': self.rng.randint(90, 120)})
 
     def spawn_fire_charge(self, start_pos, target_pos):
         sr, sc = start_pos; tr, tc = target_pos
@@ -379,40 +591,100 @@ class GameState:
             vel_r = (dr / magnitude) * speed; vel_c = (dc / magnitude) * speed
             self.fire_charges.append({'pos': [sr, sc], 'velocity': [vel_r, vel_c]})
 
+    def corridor_graph(self):
+        """Junction graph of the current grid, built once per level (and after each endless scroll)."""
+        graph = self._corridor_graph
+        if graph is None or graph.grid is not self.grid or self._corridor_graph_version != self.grid_version:
+            graph = self._corridor_graph = CorridorGraph(self.grid, self.loop_cells)
+            self._corridor_graph_version = self.grid_version
+        return graph
+
+    def hierarchical_pathfinder(self):
+        """HPA* layer for oversized mazes. Chunks are rebuilt lazily after set_cell."""
+        if self._hierarchical is None or self._hierarchical.grid is not self.grid:
+            self._hierarchical = HierarchicalPathfinder(self.grid)
+        return self._hierarchical
+
+    def _distance_field(self, name, sources):
+        key = (id(self.grid), self.grid_version, tuple(sources))
+        cached = self._fields.get(name)
+        if cached is None or cached[0] != key:
+            field = self.field_cache.get(self.grid, self.grid_version, sources) if self.field_cache is not None else DistanceField(self.grid, sources)
+            cached = self._fields[name] = (key, field)
+        return cached[1]
+
+    def threat_field(self):
+        """Walking distance to the nearest bot, creeper or enderman. Rebuilt lazily, only after one of them moves."""
+        threats = [tuple(b['pos']) for b in self.bots] + [tuple(c['pos']) for c in self.creepers]
+        if self.enderman: threats.append(tuple(self.enderman['pos']))
+        return self._distance_field('threats', threats)
+
+    def player_field(self):
+        """Walking distance from the player, for spawns that must land a safe number of steps away."""
+        return self._distance_field('player', [tuple(self.player_pos)])
+
+    def set_cell(self, r, c, value):
+        """Changes one grid cell and patches the pathfinding caches around it instead of rebuilding them."""
+        self._fields.clear()
+        if self.visibility is not None: self.visibility.invalidate()
+        if self._corridor_graph is not None and self._corridor_graph.grid is self.grid: self._corridor_graph.patch([(r, c, value)])
+        else: self.grid[r][c] = value
+        if self._hierarchical is not None and self._hierarchical.grid is self.grid: self._hierarchical.invalidate(r, c)
+
     def get_astar_path(self, start, end):
-        start, end = tuple(start), tuple(end)
-        queue = [(0, 0, start, [start])]; visited = set()
-        while queue:
-            f, g, current, path = heapq.heappop(queue)
-            if current == end: return path
-            if current in visited: continue
-            visited.add(current)
-            for dr, dc in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
-                nr, nc = current[0] + dr, current[1] + dc
-                if 0 <= nr < self.rows and 0 <= nc < self.cols and self.grid[nr][nc] == 0:
-                    h = abs(nr - end[0]) + abs(nc - end[1])
-                    heapq.heappush(queue, (g + 1 + h, g + 1, (nr, nc), path + [(nr, nc)]))
-        return []
+        if self.rows * self.cols >= HPA_MIN_CELLS: return self.hierarchical_pathfinder().find_path(start, end)
+        return self.corridor_graph().find_path(start, end)
+
+    def visible_cells(self, pos=None):
+        """Cells in line of sight of pos (the player by default), or None when there is no fog of war."""
+        if self.visibility is None: return None
+        return self.visibility.get(self.grid, self.grid_version, tuple(pos or self.player_pos))
+
+    def can_see(self, pos):
+        """Whether the player and pos see each other. Sight is symmetric, so the player's set answers for everyone."""
+        seen = self.visible_cells()
+        return seen is None or (int(round(pos[0])), int(round(pos[1]))) in seen
+
+    def random_open_cell(self, tries=20):
+        for _ in range(tries):
+            r = self.rng.randint(1, self.rows - 2); c = self.rng.randint(1, self.cols - 2)
+            if self.grid[r][c] == 0: return (r, c)
+        return None
+
+    def bot_target(self, i):
+        """The first piglin chases the player; the rest cut off where the player is heading.
+        In the fog a piglin only knows where the player is while it can see them: otherwise it heads for
+        where it last saw them, then roams."""
+        bot = self.bots[i]
+        if not self.can_see(bot['pos']):
+            if bot.get('goal') is None or tuple(bot['pos']) == bot['goal']: bot['goal'] = self.random_open_cell() or tuple(bot['pos'])
+            return bot['goal']
+        target = tuple(self.player_pos)
+        if i > 0:
+            pred_r = self.player_pos[0] + self.player_last_dir[0] * 4; pred_c = self.player_pos[1] + self.player_last_dir[1] * 4
+            pred_r = max(1, min(self.rows - 2, pred_r)); pred_c = max(1, min(self.cols - 2, pred_c))
+            if self.grid[pred_r][pred_c] == 0: target = (pred_r, pred_c)
+        if self.fog: bot['goal'] = target
+        return target
+
+    def nearest_reward(self, pos):
+        """The greedy bot's pick: the reward closest as the crow flies, or the portal once they're all gone.
+        In the fog it only picks from rewards it can see, and wanders off to look when there are none."""
+        seen = self.visible_cells(pos)
+        target = None; best_dist = float('inf')
+        for rew in self.rewards:
+            if seen is not None and rew['pos'] not in seen: continue
+            dist = abs(pos[0]-rew['pos'][0]) + abs(pos[1]-rew['pos'][1])
+            if dist < best_dist: best_dist, target = dist, rew['pos']
+        if target is None and seen is not None and self.rewards: target = self.random_open_cell()
+        return target or tuple(self.goal_pos)
 
     def use_pearl(self):
         if self.pearl_count > 0:
             self.pearl_count -= 1
-            threats = []
-            for b in self.bots: threats.append(tuple(b['pos']))
-            for c in self.creepers: threats.append(tuple(c['pos']))
-            if self.enderman: threats.append(tuple(self.enderman['pos']))
-            best_spot = self.player_pos
-            max_safety = -1
-            for _ in range(20):
-                r = random.randint(1, self.rows - 2); c = random.randint(1, self.cols - 2)
-                if self.grid[r][c] == 0:
-                    min_dist = float('inf')
-                    for t in threats:
-                        dist = abs(r - t[0]) + abs(c - t[1])
-                        if dist < min_dist: min_dist = dist
-                    if not threats: min_dist = 0 
-                    if min_dist > max_safety: max_safety = min_dist; best_spot = [r, c]
-            self.player_pos = best_spot
+            spot = self.threat_field().farthest(self.rng)
+            if spot is None: spot = self.random_open_cell() # Nothing to run from, land anywhere open
+            if spot: self.player_pos = list(spot)
 
     def use_energy_drink(self):
         if self.has_energy_drink:
@@ -420,14 +692,67 @@ class GameState:
             self.invincible_timer = 6 * FPS 
             self.speed_boost_timer = 6 * FPS 
 
+    def step(self, bits, remote_bits=0):
+        """Advances one frame from packed input bits. The live game, replays and headless runs all go through here.
+        `remote_bits` steers a networked player two (only the arrows count)."""
+        if bits & INPUT_PAUSE: self.paused = not self.paused
+        if bits & INPUT_PEARL and self.mode == "hell": self.use_pearl()
+        if bits & INPUT_DRINK and self.mode == "hell": self.use_energy_drink()
+        if not self.paused and self.game_active:
+            if self.move_timer > 0: self.move_timer -= 1
+            else:
+                dx, dy = 0, 0
+                if bits & INPUT_LEFT: dx = -1
+                elif bits & INPUT_RIGHT: dx = 1
+                elif bits & INPUT_UP: dy = -1
+                elif bits & INPUT_DOWN: dy = 1
+                if dx != 0 or dy != 0: self.move_player(dx, dy); self.move_timer = self.move_delay
+            for bot in self.bots:
+                if bot['state'] == 'REMOTE': self._move_remote(bot, remote_bits)
+        self.update()
+
+    def _move_remote(self, bot, bits):
+        """Player two moves with the same timer rules as the player, at the bot's (potion-affected) speed."""
+        if bot['move_timer'] > 0: bot['move_timer'] -= 1; return
+        dr, dc = 0, 0
+        if bits & INPUT_LEFT: dc = -1
+        elif bits & INPUT_RIGHT: dc = 1
+        elif bits & INPUT_UP: dr = -1
+        elif bits & INPUT_DOWN: dr = 1
+        if dr == 0 and dc == 0: return
+        bot['move_timer'] = bot['speed']
+        if self.is_warming_up: return
+        nr, nc = bot['pos'][0] + dr, bot['pos'][1] + dc
+        if 0 <= nr < self.rows and 0 <= nc < self.cols and self.grid[nr][nc] == 0:
+            bot['pos'] = [nr, nc]; self._bot_arrived(bot)
+
+    def _bot_arrived(self, bot):
+        """VS pickups and the win check for a bot (or player two) that has just stepped onto a cell."""
+        for j in range(len(self.rewards)-1, -1, -1):
+            if self.rewards[j]['pos'] == tuple(bot['pos']):
+                r = self.rewards[j]
+                if r['type'] == 'points': bot['score'] += r['val']
+                elif r['type'] == 'swiftness': self.ai_speed_boost_timer = 5 * FPS
+                elif r['type'] == 'slowness': self.player_slow_timer = 5 * FPS
+                self.rewards.pop(j)
+                if bot['state'] == 'MOVING': bot['state'] = 'THINKING'
+        if bot['pos'] == self.goal_pos and bot['score'] > 0:
+            winner = "Player 2" if bot['state'] == 'REMOTE' else "AI"
+            self.game_active = False; self.game_won = False; self.game_over_text = f"{winner} Wins! Score: {bot['score']}"
+
     def update(self):
         if self.paused or not self.game_active: return
         if self.is_warming_up:
-            if pygame.time.get_ticks() - self.start_ticks > self.warmup_duration:
+            self.warmup_timer -= 1
+            if self.warmup_timer <= 0:
                 self.is_warming_up = False
             return 
         self.game_time += 1
 
+        if self.endless:
+            # Keep the player in the upper half of the window; scroll in pairs so rows keep their parity
+            while self.player_pos[0] > self.rows // 2 + 1: self._scroll_window(2)
+
         if self.mode == "vs_ai":
             if self.game_time > 450 and not self.heart_spawned: self.spawn_heart()
             self.move_delay = self.base_move_delay
@@ -451,7 +776,7 @@ class GameState:
             if self.ghast_spawn_timer > 0: self.ghast_spawn_timer -= 1
             if len(self.ghasts) < 2 and self.ghast_spawn_timer <= 0:
                 chance = 0.002 if len(self.ghasts) == 0 else 0.0005
-                if random.random() < chance: self.spawn_ghast(); self.ghast_spawn_timer = 13 * FPS
+                if self.rng.random() < chance: self.spawn_ghast(); self.ghast_spawn_timer = 13 * FPS
 
             for g in self.ghasts[:]:
                 g['t'] += g['speed']
@@ -462,7 +787,10 @@ class GameState:
                     c = (uu * g['p0'][1]) + (2 * u * t * g['p1'][1]) + (tt * g['p2'][1])
                     g['pos'] = (r, c)
                     g['shoot_timer'] -= 1
-                    if g['shoot_timer'] <= 0: self.spawn_fire_charge(g['pos'], self.player_pos); g['shoot_timer'] = random.randint(90, 120)
+                    if g['shoot_timer'] <= 0:
+                        if self.can_see(g['pos']): g['aim'] = tuple(self.player_pos) # In the fog, fire where the player was last seen
+                        if g.get('aim'): self.spawn_fire_charge(g['pos'], g['aim'])
+                        g['shoot_timer'] = self.rng.randint(90, 120)
 
             for fc in self.fire_charges[:]:
                 fc['pos'][0] += fc['velocity'][0]; fc['pos'][1] += fc['velocity'][1]
@@ -478,16 +806,15 @@ class GameState:
                     self.game_active = False; self.game_won = False; self.death_type = "explosion"; self.game_over_text = "SLAIN BY ENDERMAN!"
                 if self.enderman['teleport_timer'] >= self.enderman['teleport_interval']:
                     self.enderman['teleport_timer'] = 0
-                    for _ in range(10):
-                        r = random.randint(1, self.rows - 2); c = random.randint(1, self.cols - 2)
-                        if self.grid[r][c] == 0: self.enderman['pos'] = [r, c]; break
+                    spot = self.random_open_cell(10)
+                    if spot: self.enderman['pos'] = list(spot)
                 if self.enderman['duration'] <= 0: self.enderman = None
             else:
-                if self.game_time > 10 * FPS and self.game_time % 90 == 0 and random.random() < 0.30: self.spawn_enderman()
+                if self.game_time > 10 * FPS and self.game_time % 90 == 0 and self.rng.random() < 0.30: self.spawn_enderman()
 
             for c_idx, creep in enumerate(self.creepers):
                 dist_r = abs(creep['pos'][0] - self.player_pos[0]); dist_c = abs(creep['pos'][1] - self.player_pos[1])
-                in_radius = max(dist_r, dist_c) <= creep['radius']
+                in_radius = max(dist_r, dist_c) <= creep['radius'] and self.can_see(creep['pos'])
                 if in_radius:
                     creep['state'] = 'FUSE'; creep['fuse'] -= 1; creep['blink_timer'] = creep.get('blink_timer', 0) + 1
                     if creep['fuse'] <= 0:
@@ -508,6 +835,8 @@ class GameState:
                         if (0 < nr < self.rows and 0 < nc < self.cols and self.grid[nr][nc] == 0 and start_dist <= creep['range']): creep['pos'] = [nr, nc]
                         else: creep['dir'] *= -1
 
+        if self.mode == "hell": self.bot_planner.update(self)
+
         for i, bot in enumerate(self.bots):
             bot['timer'] += 1
             if self.mode == "vs_ai":
@@ -515,40 +844,21 @@ class GameState:
                     if self.has_shield: self.has_shield = False; self.game_over_text = "Shield Blocked Theft!" 
                     else:
                         steal_amount = min(10, self.user_score); self.user_score -= steal_amount; bot['score'] += steal_amount
+                if bot['state'] == 'THINKING' and self.opponent: self.opponent.think(self, bot)
                 if bot['state'] == 'THINKING' and bot['timer'] >= 30:
-                    target = None; best_dist = float('inf')
-                    for rew in self.rewards:
-                        dist = abs(bot['pos'][0]-rew['pos'][0]) + abs(bot['pos'][1]-rew['pos'][1])
-                        if dist < best_dist: best_dist, target = dist, rew['pos']
-                    if not target: target = tuple(self.goal_pos)
+                    target = self.opponent.choose(bot) if self.opponent else None
+                    if target is None: target = self.nearest_reward(bot['pos'])
                     bot['path'] = self.get_astar_path(bot['pos'], target); bot['path'].pop(0) if len(bot['path']) > 0 else None
                     bot['state'] = 'MOVING'; bot['timer'] = 0
                 elif bot['state'] == 'MOVING' and bot['timer'] >= bot['speed']:
                     bot['timer'] = 0
                     if bot['path']:
                         bot['pos'] = list(bot['path'].pop(0))
-                        for j in range(len(self.rewards)-1, -1, -1):
-                            if self.rewards[j]['pos'] == tuple(bot['pos']):
-                                r = self.rewards[j]
-                                if r['type'] == 'points': bot['score'] += r['val']
-                                elif r['type'] == 'swiftness': self.ai_speed_boost_timer = 5 * FPS
-                                elif r['type'] == 'slowness': self.player_slow_timer = 5 * FPS
-                                self.rewards.pop(j); bot['state'] = 'THINKING'
-                        if bot['pos'] == self.goal_pos and bot['score'] > 0:
-                            self.game_active = False; self.game_won = False; self.game_over_text = f"AI Wins! Score: {bot['score']}"
+                        self._bot_arrived(bot)
                     else: bot['state'] = 'THINKING'
 
             elif self.mode == "hell":
-                if random.random() < 0.005: self.bombs.append({'pos': tuple(bot['pos']), 'timer': 15 * FPS})
-                bot['repath_timer'] = bot.get('repath_timer', 0) + 1
-                if bot['repath_timer'] > 10 or not bot['path']:
-                    target = list(self.player_pos)
-                    if i > 0:
-                        pred_r = self.player_pos[0] + self.player_last_dir[0] * 4; pred_c = self.player_pos[1] + self.player_last_dir[1] * 4
-                        pred_r = max(1, min(self.rows - 2, pred_r)); pred_c = max(1, min(self.cols - 2, pred_c))
-                        if self.grid[pred_r][pred_c] == 0: target = [pred_r, pred_c]
-                    bot['path'] = self.get_astar_path(bot['pos'], target); bot['path'].pop(0) if len(bot['path']) > 0 else None
-                    bot['repath_timer'] = 0
+                if self.rng.random() < 0.005: self.bombs.append({'pos': tuple(bot['pos']), 'timer': 15 * FPS})
                 if bot['timer'] >= bot['speed']:
                     bot['timer'] = 0
                     if bot['path']:
@@ -565,6 +875,7 @@ class GameState:
 
         self.player_last_dir = (dy, dx)
         new_r, new_c = self.player_pos[0] + dy, self.player_pos[1] + dx
+        if not (0 <= new_r < self.rows and 0 <= new_c < self.cols): return
         
         if self.grid[new_r][new_c] == 0:
             self.player_pos = [new_r, new_c]
@@ -623,6 +934,436 @@ class GameState:
                 elif self.mode == "hell":
                     self.game_active = False; self.game_won = True; self.death_type = "win"; self.game_over_text = f"SURVIVED! Score: {self.user_score}"
 
+class BotPlanner:
+    """THE HIVE MIND: Plans hell bots together with windowed cooperative A* over one shared space-time
+    reservation table, so piglins spread out instead of stacking. Repaths wait in a queue and are worked
+    off against a per-frame search budget (counted in expansions rather than wall time, so replays stay
+    deterministic), which spreads the planning of a big pack over several frames."""
+    def __init__(self, window=8, budget=400, repath_interval=10):
+        self.window = window
+        self.budget = budget
+        self.repath_interval = repath_interval
+        self.table = ReservationTable()
+        self.queue = deque()
+        self.expansions = 0 # Spent on the last frame
+
+    def reset(self):
+        self.table.clear(); self.queue.clear()
+
+    def request(self, bot_id):
+        if bot_id not in self.queue: self.queue.append(bot_id)
+
+    def update(self, state):
+        now = state.game_time
+        for bot in state.bots:
+            bot['repath_timer'] = bot.get('repath_timer', 0) + 1
+            if bot['repath_timer'] > self.repath_interval or not bot['path']: self.request(bot['id']); bot['repath_timer'] = 0
+        if now % FPS == 0: self.table.prune(now)
+
+        bots = {b['id']: (i, b) for i, b in enumerate(state.bots)}
+        spent = 0
+        while self.queue and spent < self.budget:
+            bot_id = self.queue.popleft()
+            if bot_id not in bots: self.table.release(bot_id); continue
+            spent += self._plan(state, *bots[bot_id], now)
+        self.expansions = spent
+
+    def _plan(self, state, i, bot, now):
+        target = state.bot_target(i)
+        field = state._distance_field(('goal', bot['id']) if state.fog else 'chase' if i == 0 else 'cut_off', [target])
+        step = bot['speed']
+        first_move = now + max(0, step - 1 - bot['timer'])
+        self.table.release(bot['id'])
+        cells, spent = cooperative_search(state.grid, bot['pos'], field, first_move, step, self.window, self.table, bot['id'])
+        if cells is None: cells = state.get_astar_path(bot['pos'], target)[1:] # Boxed in: fall back to a selfish path
+        self.table.reserve(bot['id'], tuple(bot['pos']), now, first_move + 1)
+        t = first_move
+        for cell in cells[:self.window]:
+            self.table.reserve(bot['id'], cell, t, t + step); t += step
+        bot['path'] = list(cells)
+        return max(1, spent)
+
+    def copy(self):
+        twin = BotPlanner(self.window, self.budget, self.repath_interval)
+        twin.table = self.table.copy(); twin.queue = deque(self.queue); twin.expansions = self.expansions
+        return twin
+
+class LookaheadOpponent:
+    """THE STRATEGIST: A vs_ai bot that looks before it leaps. While the bot stands THINKING it plays each
+    candidate target a few seconds forward on cloned states, against a scripted player, and commits to the
+    one that leaves it furthest ahead. Rollouts are paid for from a per-frame budget of simulated frames
+    (not wall time, so replays stay deterministic)."""
+    def __init__(self, seed, candidates=4, horizon=6 * FPS, budget=LOOKAHEAD_BUDGET):
+        self.rng = random.Random(seed) # Drives the scripted player, never the game itself
+        self.candidates = candidates
+        self.horizon = horizon
+        self.budget = budget
+        self.search = None # [bot id, root clone, targets, [score sum, rollouts] per target]
+        self.rollouts = 0 # Finished on the last frame
+
+    def copy(self):
+        twin = LookaheadOpponent(0, self.candidates, self.horizon, self.budget)
+        twin.rng.setstate(self.rng.getstate())
+        if self.search: twin.search = self.search[:3] + [[list(t) for t in self.search[3]]] # The root is never stepped
+        twin.rollouts = self.rollouts
+        return twin
+
+    def think(self, state, bot):
+        if self.search is None or self.search[0] != bot['id']: self._start(state, bot)
+        _, root, targets, totals = self.search
+        spent = rollouts = 0
+        while targets and spent < self.budget:
+            i = min(range(len(targets)), key=lambda j: totals[j][1])
+            score, frames = self._rollout(root, bot['id'], targets[i])
+            totals[i][0] += score; totals[i][1] += 1
+            spent += frames; rollouts += 1
+        self.rollouts = rollouts
+
+    def choose(self, bot):
+        """Ends the search and returns the best target found, or None to fall back on the greedy pick."""
+        search, self.search = self.search, None
+        if search is None or search[0] != bot['id']: return None
+        _, _, targets, totals = search
+        scored = [(total / runs, -i) for i, (total, runs) in enumerate(totals) if runs]
+        if not scored: return None
+        return targets[-max(scored)[1]]
+
+    def _start(self, state, bot):
+        root = state.clone(); root.opponent = None # Inside a rollout the bot plays greedy after its first leg
+        field = DistanceField(state.grid, [tuple(bot['pos'])])
+        targets = sorted((r['pos'] for r in state.rewards if field.distance(r['pos']) is not None), key=field.distance)[:self.candidates]
+        if bot['score'] > 0 or not targets: targets.append(tuple(state.goal_pos))
+        self.search = [bot['id'], root, targets, [[0, 0] for _ in targets]]
+
+    def _rollout(self, root, bot_id, target):
+        """Plays one horizon forward with the bot sent to `target`. Returns (bot's lead at the end, frames run)."""
+        sim = root.clone()
+        bot = next(b for b in sim.bots if b['id'] == bot_id)
+        bot['path'] = sim.get_astar_path(bot['pos'], target)[1:]; bot['state'] = 'MOVING'; bot['timer'] = 0
+        plan = []
+        frames = 0
+        while frames < self.horizon and sim.game_active:
+            if plan and tuple(sim.player_pos) == plan[0]: plan.pop(0)
+            if not plan: plan = self._player_plan(sim)
+            bits = 0
+            if plan:
+                dr = plan[0][0] - sim.player_pos[0]; dc = plan[0][1] - sim.player_pos[1]
+                bits = INPUT_DOWN if dr > 0 else INPUT_UP if dr < 0 else INPUT_RIGHT if dc > 0 else INPUT_LEFT
+            sim.step(bits); frames += 1
+        lead = bot['score'] - sim.user_score
+        if not sim.game_active: lead += -1000 if sim.game_won else 1000
+        return lead, frames
+
+    def _player_plan(self, sim):
+        """The scripted player heads for one of the two closest rewards, or the key and portal when it can win."""
+        goals = [r['pos'] for r in sim.rewards]
+        if sim.key_pos and not sim.has_key: goals.append(sim.key_pos)
+        if sim.has_key and sim.user_score > 0: goals = [tuple(sim.goal_pos)]
+        if not goals: return []
+        pr, pc = sim.player_pos
+        goals.sort(key=lambda p: abs(p[0] - pr) + abs(p[1] - pc))
+        return sim.get_astar_path(sim.player_pos, self.rng.choice(goals[:2]))[1:]
+
+# --- REWIND ---
+def state_delta(old, new):
+    """What changed between two snapshot values, or None. Containers are compared member by member, so a
+    delta holds only the entities and timers that actually changed; anything else is stored whole. Changes
+    are flat tuples, (kind, key, change, key, change, ...): a dict per changed entity cost more than the
+    timer it held."""
+    if old is new: return None
+    if type(old) is not type(new): return ('=', new)
+    if isinstance(new, dict):
+        changes = ['d']
+        for k, v in new.items():
+            if k not in old: changes += (k, ('=', v))
+            else:
+                d = state_delta(old[k], v)
+                if d is not None: changes += (k, d)
+        for k in old:
+            if k not in new: changes += (k, ('-',))
+        return tuple(changes) if len(changes) > 1 else None
+    if isinstance(new, (list, tuple)):
+        if len(old) == len(new):
+            changes = ['l']
+            for i, (a, b) in enumerate(zip(old, new)):
+                if a is b or (type(a) is type(b) and type(a) in (int, float, str, bool) and a == b): continue
+                d = state_delta(a, b)
+                if d is not None: changes += (i, d)
+            if len(changes) == 1: return None
+            # A scalar changed costs two slots and a tuple, the whole list a pointer per item: only a long list
+            # with a few changes (the rng index ticking) is worth a delta. Entities always are, their timers tick.
+            if len(changes) * 4 > len(new) and all(d[0] == '=' for d in changes[2::2]): return ('=', new)
+            return tuple(changes)
+        # Spawns and removals: keep the common ends, store the middle
+        start, old_stop, new_stop = 0, len(old), len(new)
+        while start < old_stop and start < new_stop and old[start] == new[start]: start += 1
+        while old_stop > start and new_stop > start and old[old_stop - 1] == new[new_stop - 1]: old_stop -= 1; new_stop -= 1
+        return ('s', start, old_stop, new[start:new_stop])
+    if hasattr(new, '__dict__'):
+        d = state_delta(old.__dict__, new.__dict__)
+        return ('o',) + d[1:] if d else None
+    return None if old == new else ('=', new)
+
+def apply_state_delta(value, delta):
+    """Returns `value` with a state_delta applied. Copy on write: `value` itself is left alone."""
+    kind = delta[0]
+    if kind == '=': return delta[1]
+    if kind == 'd' or kind == 'o':
+        out = dict(value.__dict__ if kind == 'o' else value)
+        for k, d in zip(delta[1::2], delta[2::2]):
+            if d[0] == '-': del out[k]
+            else: out[k] = apply_state_delta(out.get(k), d)
+        if kind == 'd': return out
+        obj = object.__new__(type(value)); obj.__dict__ = out
+        return obj
+    if kind == 'l':
+        out = list(value)
+        for i, d in zip(delta[1::2], delta[2::2]): out[i] = apply_state_delta(out[i], d)
+        return out if type(value) is list else type(value)(out)
+    _, start, stop, items = delta # 's'
+    return value[:start] + items + value[stop:]
+
+def footprint(value, seen):
+    """Approximate bytes held by a value, not counting anything whose id is already in `seen`."""
+    if id(value) in seen or (type(value) is int and -5 <= value <= 256): return 0 # Small ints are preallocated
+    if type(value) is str: return 0 # Names and state labels, interned literals shared with the game
+    seen.add(id(value))
+    size = getsizeof(value)
+    if isinstance(value, dict): size += sum(footprint(v, seen) for v in value.values())
+    elif isinstance(value, (list, tuple, set, frozenset, deque)): size += sum(footprint(v, seen) for v in value)
+    elif hasattr(value, '__dict__') and not isinstance(value, type): size += footprint(value.__dict__, seen)
+    return size
+
+class RewindBuffer:
+    """THE VCR: The last few seconds of a game as a ring of keyframe snapshots, each followed by per-frame
+    deltas. Stepping back restores the keyframe before the target and replays at most a second of deltas;
+    stepping forward applies one delta. Memory is capped by frame count and by bytes, whichever bites first."""
+    SHARED = ('grid', '_corridor_graph', '_hierarchical', 'field_cache', 'visibility', 'maze_generator', 'maze_stream', 'loop_cells', 'ai_path_display')
+
+    def __init__(self, seconds=10, keyframe_interval=FPS, max_bytes=4 * 2**20):
+        self.capacity = max(1, int(seconds * FPS))
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self.groups = deque() # [keyframe, [delta or None per later frame], bytes]
+        self.frames = 0       # Stored frames, keyframes included
+        self.memory = 0       # Estimated bytes held, the shared maze and caches not included
+        self.cursor = None    # (frame index, snapshot at it) after a seek, so stepping forward is one delta
+        self.last = None      # Snapshot of the newest frame, the base of the next delta
+
+    def _shared_ids(self, snap):
+        return {id(snap[k]) for k in self.SHARED}
+
+    def record(self, state):
+        """Stores the frame the state has just reached. Call once per step."""
+        snap = state.snapshot()
+        snap['_fields'] = {} # Distance fields are a cache, rebuilt after a seek
+        if self.cursor is not None: self._truncate(self.cursor[0]); self.cursor = None
+        if not self.groups or len(self.groups[-1][1]) + 1 >= self.keyframe_interval:
+            size = footprint(snap, self._shared_ids(snap))
+            self.groups.append([snap, [], size])
+        else:
+            delta = state_delta(self.last, snap)
+            size = footprint(delta, self._shared_ids(snap)) if delta else 0
+            self.groups[-1][1].append(delta); self.groups[-1][2] += size
+        self.last = snap
+        self.frames += 1; self.memory += size
+        while len(self.groups) > 1 and (self.frames - len(self.groups[0][1]) - 1 >= self.capacity or self.memory > self.max_bytes):
+            _, deltas, size = self.groups.popleft()
+            self.frames -= len(deltas) + 1; self.memory -= size
+
+    def _truncate(self, index):
+        """Forgets every frame after `index`, so play can branch off from a rewound point."""
+        while self.frames - 1 > index:
+            keyframe, deltas, size = self.groups[-1]
+            if self.frames - len(deltas) - 1 > index: # The whole group is in the future
+                self.groups.pop(); self.frames -= len(deltas) + 1; self.memory -= size; continue
+            keep = len(deltas) - (self.frames - 1 - index)
+            shared = self._shared_ids(keyframe)
+            dropped = sum(footprint(d, shared) for d in deltas[keep:] if d)
+            del deltas[keep:]; self.groups[-1][2] -= dropped; self.memory -= dropped; self.frames = index + 1
+        self.last = self.cursor[1]
+
+    def _snapshot_at(self, index):
+        if self.cursor is not None and self.cursor[0] <= index:
+            at, snap = self.cursor # Walking forward from where we are beats restarting at a keyframe
+        else: at, snap = None, None
+        first = 0
+        for keyframe, deltas, _ in self.groups:
+            if index <= first + len(deltas):
+                if at is None or at < first: at, snap = first, keyframe
+                for d in deltas[at - first:index - first]:
+                    if d: snap = apply_state_delta(snap, d)
+                return snap
+            first += len(deltas) + 1
+        raise IndexError(index)
+
+    def seek(self, state, index):
+        """Puts the state back at stored frame `index` (0 is the oldest kept). Recording again drops the frames after it."""
+        index = max(0, min(self.frames - 1, index))
+        snap = self._snapshot_at(index)
+        state.restore(snap)
+        self.cursor = (index, snap)
+        return index
+
+    def position(self):
+        return self.cursor[0] if self.cursor is not None else self.frames - 1
+
+    def step_back(self, state, frames=1):
+        """Rewinds up to `frames` frames. Returns how many it actually went back."""
+        if not self.frames: return 0
+        now = self.position()
+        return now - self.seek(state, now - frames)
+
+    def step_forward(self, state, frames=1):
+        if not self.frames: return 0
+        now = self.position()
+        return self.seek(state, now + frames) - now
+
+    def stats(self):
+        return {'frames': self.frames, 'seconds': self.frames / FPS, 'keyframes': len(self.groups), 'bytes': self.memory}
+
+class LevelFactory:
+    """THE KITCHEN: Cooks the next level (maze, entities and background) on a worker thread."""
+    def __init__(self, renderer, max_ready=2, opponent="greedy", lookahead_budget=LOOKAHEAD_BUDGET):
+        self.renderer = renderer
+        self.opponent = opponent
+        self.lookahead_budget = lookahead_budget
+        self.max_ready = max_ready
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="level-factory")
+        self.pending = OrderedDict() # preset -> Future of (state, prepared background)
+
+    def _build(self, preset):
+        rows, mode, endless, fog = preset
+        state = GameState(rows, mode, endless=endless, opponent=self.opponent, fog=fog, lookahead_budget=self.lookahead_budget)
+        return state, self.renderer.build_level_surface(state)
+
+    def prefetch(self, preset):
+        if preset in self.pending: self.pending.move_to_end(preset); return
+        self.pending[preset] = self.executor.submit(self._build, preset)
+        while len(self.pending) > self.max_ready:
+            _, future = self.pending.popitem(last=False); future.cancel()
+
+    def take(self, preset):
+        """Returns a ready (state, prepared) pair, building it on the spot if the worker hasn't got to it."""
+        future = self.pending.pop(preset, None)
+        if future is None or future.cancelled(): state, prepared = self._build(preset)
+        else: state, prepared = future.result()
+        return state, prepared
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class ReplayRecorder:
+    """THE TAPE: Records a game's seed and per-frame input bits as run-length pairs."""
+    MAGIC = b"SRPL"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHBBBBHIIQ") # magic, version, mode, flags (REPLAY_FLAG_*), generator, opponent, lookahead budget, rows, cols, seed
+    HEADER_V1 = struct.Struct("<4sHBBBBIIQ") # Before the lookahead budget was stored; those games ran with 900
+    RUN = struct.Struct("<BH")            # input bits, frames held
+    FOOTER = struct.Struct("<IIH")        # frames, final digest, outcome text length
+
+    def __init__(self, game):
+        self.header = (self.MAGIC, self.VERSION, LEVEL_MODES.index(game.mode), REPLAY_FLAG_ENDLESS * game.endless | REPLAY_FLAG_FOG * game.fog,
+                       list(MAZE_GENERATORS).index(game.maze_generator.name), LEVEL_OPPONENTS.index(game.opponent_kind),
+                       game.opponent.budget if game.opponent else 0, game.rows, game.cols, game.seed)
+        self.runs = []
+        self.frames = 0
+
+    def record(self, bits):
+        self.frames += 1
+        if self.runs and self.runs[-1][0] == bits and self.runs[-1][1] < 0xFFFF: self.runs[-1][1] += 1
+        else: self.runs.append([bits, 1])
+
+    def truncate(self, frames):
+        """Drops everything recorded after the first `frames` frames (the game was rewound)."""
+        while self.frames > frames:
+            cut = min(self.runs[-1][1], self.frames - frames)
+            self.runs[-1][1] -= cut; self.frames -= cut
+            if not self.runs[-1][1]: self.runs.pop()
+
+    def save(self, path, game):
+        outcome = game.game_over_text.encode()
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(*self.header))
+            f.write(struct.pack("<I", len(self.runs)))
+            f.write(b"".join(self.RUN.pack(bits, count) for bits, count in self.runs))
+            f.write(self.FOOTER.pack(self.frames, game.digest(), len(outcome)) + outcome)
+
+class Replay:
+    """A recorded game that can be played back headless at full speed."""
+    def __init__(self, path):
+        rec = ReplayRecorder
+        with open(path, 'rb') as f: data = f.read()
+        magic, version = struct.unpack_from("<4sH", data, 0)
+        if magic != rec.MAGIC: raise ValueError(f"{path} is not a replay file")
+        if version == 1:
+            header = rec.HEADER_V1
+            _, _, mode, flags, generator, opponent, self.rows, self.cols, self.seed = header.unpack_from(data, 0)
+            self.lookahead_budget = 900
+        elif version == rec.VERSION:
+            header = rec.HEADER
+            _, _, mode, flags, generator, opponent, self.lookahead_budget, self.rows, self.cols, self.seed = header.unpack_from(data, 0)
+        else: raise ValueError(f"{path} has unsupported replay version {version}")
+        self.mode, self.generator = LEVEL_MODES[mode], list(MAZE_GENERATORS)[generator]
+        self.endless, self.fog = bool(flags & REPLAY_FLAG_ENDLESS), bool(flags & REPLAY_FLAG_FOG)
+        self.opponent = LEVEL_OPPONENTS[opponent]
+        offset = header.size
+        (run_count,) = struct.unpack_from("<I", data, offset); offset += 4
+        self.runs = [rec.RUN.unpack_from(data, offset + i * rec.RUN.size) for i in range(run_count)]
+        offset += run_count * rec.RUN.size
+        self.frames, self.digest, text_len = rec.FOOTER.unpack_from(data, offset); offset += rec.FOOTER.size
+        self.outcome = data[offset:offset + text_len].decode()
+
+    def new_game(self):
+        return GameState(self.rows, self.mode, cols=self.cols, generator=self.generator, endless=self.endless, seed=self.seed, opponent=self.opponent, fog=self.fog,
+                         lookahead_budget=self.lookahead_budget or LOOKAHEAD_BUDGET)
+
+    def play(self, game=None):
+        """Re-runs every recorded frame. Returns the finished game; compare game.digest() with self.digest."""
+        game = game or self.new_game()
+        step = game.step
+        for bits, count in self.runs:
+            for _ in range(count): step(bits)
+        return game
+
+# Effect levels, each dropping more than the last
+QUALITY_FULL, QUALITY_NO_AURAS, QUALITY_STATIC_REWARDS, QUALITY_CHEAP_OVERLAYS, QUALITY_LOW_RES = range(5)
+QUALITY_NAMES = ("full", "no auras", "static rewards", "cheap overlays", "low-res background")
+
+class QualityManager:
+    """THE DIMMER: Watches how long frames take to build and steps effects down a level when the slow end
+    of the last second runs over budget, or back up when even the slow end has plenty of headroom. The gap
+    between the two thresholds plus a cooldown after every change (hysteresis) keep it from flapping."""
+    def __init__(self, budget=1 / FPS, window=FPS, down_at=0.9, up_at=0.5, cooldown=2 * FPS, level=QUALITY_FULL):
+        self.budget = budget
+        self.down_at = down_at
+        self.up_at = up_at
+        self.cooldown = cooldown
+        self.samples = deque(maxlen=window)
+        self.level = level
+        self.wait = cooldown # Frames left before the next change is allowed
+        self.changes = 0
+
+    @property
+    def name(self):
+        return QUALITY_NAMES[self.level]
+
+    @property
+    def background_scale(self):
+        return 2 if self.level >= QUALITY_LOW_RES else 1
+
+    def record(self, frame_seconds):
+        """Feeds one frame's work time (update and draw, not the sleep). Returns True when the level changed."""
+        self.samples.append(frame_seconds)
+        if self.wait > 0: self.wait -= 1; return False
+        if len(self.samples) < self.samples.maxlen: return False
+        slow = sorted(self.samples)[len(self.samples) * 9 // 10]
+        if slow > self.budget * self.down_at and self.level < QUALITY_LOW_RES: self.level += 1
+        elif slow < self.budget * self.up_at and self.level > QUALITY_FULL: self.level -= 1
+        else: return False
+        self.samples.clear(); self.wait = self.cooldown; self.changes += 1
+        return True
+
 class GameRenderer:
     """THE ARTIST: Handles drawing shapes, text, images and UI."""
     def __init__(self, screen):
@@ -633,7 +1374,14 @@ class GameRenderer:
         self.cached_cell_size = 0
         self.cached_margin_x = 0
         self.cached_margin_y = 0
+        self.cached_grid_version = -1
+        self.cached_background_scale = 1
+        self.fog_mask = None  # One pixel per cell: FOG_COLOR where the player can't see, clear where they can
+        self.fog_cells = None # The visible set the mask was last patched to
+        self.fog_layer = None # The mask stretched over the maze
         self.menu_panorama = None
+        self.quality = QualityManager()
+        self.rewind = None # The game's RewindBuffer, if any, so the status bar can show what it holds
         self.load_assets()
         
         # Fonts - Main Menu Specific
@@ -705,48 +1453,81 @@ class GameRenderer:
         if img and not isinstance(img, list) and not isinstance(img, bool): return pygame.transform.scale(img, (w, h))
         return None
 
-    def init_level(self, state):
+    def build_level_surface(self, state, scale=None):
+        """Renders the static maze background. Touches no renderer state, so it is safe on a worker thread.
+        With scale > 1 it is painted at 1/scale size and stretched, which makes endless-mode rebuilds cheaper."""
+        scale = scale or self.quality.background_scale
         available_height = SCREEN_HEIGHT - UI_HEIGHT
-        self.cached_cell_size = min(SCREEN_WIDTH // state.cols, available_height // state.rows)
-        self.cached_margin_x = (SCREEN_WIDTH - (state.cols * self.cached_cell_size)) // 2
-        self.cached_margin_y = UI_HEIGHT + (available_height - (state.rows * self.cached_cell_size)) // 2
+        cell_size = min(SCREEN_WIDTH // state.cols, available_height // state.rows)
+        margin_x = (SCREEN_WIDTH - (state.cols * cell_size)) // 2
+        margin_y = UI_HEIGHT + (available_height - (state.rows * cell_size)) // 2
+        small = cell_size // scale + 1 # Painted cell size, overlapping by a pixel so no seams open up
         
         scaled_walls = []
         if self.wall_textures:
-            for w_tex in self.wall_textures: scaled_walls.append(pygame.transform.scale(w_tex, (self.cached_cell_size + 1, self.cached_cell_size + 1)))
+            for w_tex in self.wall_textures: scaled_walls.append(pygame.transform.scale(w_tex, (small, small)))
 
-        self.background_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-        self.background_surface.fill(WALL_COLOR)
+        surface = pygame.Surface((SCREEN_WIDTH // scale, SCREEN_HEIGHT // scale))
+        surface.fill(WALL_COLOR)
         for r in range(state.rows):
             for c in range(state.cols):
-                x = self.cached_margin_x + c * self.cached_cell_size
-                y = self.cached_margin_y + r * self.cached_cell_size
+                x = (margin_x + c * cell_size) // scale
+                y = (margin_y + r * cell_size) // scale
                 if state.grid[r][c] == 1:
-                    if scaled_walls: self.background_surface.blit(scaled_walls[(r*7+c*13)%len(scaled_walls)], (x, y))
-                    else: pygame.draw.rect(self.background_surface, WALL_COLOR, (x, y, self.cached_cell_size + 1, self.cached_cell_size + 1))
-                else: pygame.draw.rect(self.background_surface, NETHER_FOG, (x, y, self.cached_cell_size + 1, self.cached_cell_size + 1))
+                    if scaled_walls: surface.blit(scaled_walls[(r*7+c*13)%len(scaled_walls)], (x, y))
+                    else: pygame.draw.rect(surface, WALL_COLOR, (x, y, small, small))
+                else: pygame.draw.rect(surface, NETHER_FOG, (x, y, small, small))
         
         vine_img = self.assets.get('vines')
         if vine_img and not isinstance(vine_img, bool):
-            if self.cached_margin_y > 0:
-                scaled_h = pygame.transform.scale(vine_img, (SCREEN_WIDTH, self.cached_margin_y))
-                self.background_surface.blit(scaled_h, (0, UI_HEIGHT)); self.background_surface.blit(scaled_h, (0, SCREEN_HEIGHT - self.cached_margin_y)) 
-            if self.cached_margin_x > 0:
-                scaled_v = pygame.transform.scale(vine_img, (self.cached_margin_x, SCREEN_HEIGHT))
-                self.background_surface.blit(scaled_v, (0, 0)); self.background_surface.blit(scaled_v, (SCREEN_WIDTH - self.cached_margin_x, 0))
+            if margin_y > 0:
+                scaled_h = pygame.transform.scale(vine_img, (SCREEN_WIDTH // scale, margin_y // scale))
+                surface.blit(scaled_h, (0, UI_HEIGHT // scale)); surface.blit(scaled_h, (0, (SCREEN_HEIGHT - margin_y) // scale)) 
+            if margin_x > 0:
+                scaled_v = pygame.transform.scale(vine_img, (margin_x // scale, SCREEN_HEIGHT // scale))
+                surface.blit(scaled_v, (0, 0)); surface.blit(scaled_v, ((SCREEN_WIDTH - margin_x) // scale, 0))
+        if scale > 1: surface = pygame.transform.scale(surface, (SCREEN_WIDTH, SCREEN_HEIGHT))
+        return surface, cell_size, margin_x, margin_y, state.grid_version, scale
+
+    def init_level(self, state, prepared=None):
+        if prepared is None or prepared[4] != state.grid_version or prepared[5] != self.quality.background_scale: prepared = self.build_level_surface(state)
+        surface, self.cached_cell_size, self.cached_margin_x, self.cached_margin_y, self.cached_grid_version, self.cached_background_scale = prepared
+        self.background_surface = surface.convert() # Match the display format once instead of on every blit
+        self.fog_mask = self.fog_cells = self.fog_layer = None
+
+    def draw_fog(self, state, seen):
+        """Darkens every cell outside `seen`. Only cells that changed sides get repainted on the mask, and it is
+        stretched again only when the visible set changes, so a player standing still costs one blit."""
+        if self.fog_cells is not seen:
+            if self.fog_mask is None: self.fog_mask = pygame.Surface((state.cols, state.rows), pygame.SRCALPHA); self.fog_mask.fill(FOG_COLOR); old = frozenset()
+            else: old = self.fog_cells
+            for r, c in old - seen: self.fog_mask.set_at((c, r), FOG_COLOR)
+            for r, c in seen - old: self.fog_mask.set_at((c, r), (0, 0, 0, 0))
+            self.fog_cells = seen
+            self.fog_layer = pygame.transform.scale(self.fog_mask, (state.cols * self.cached_cell_size, state.rows * self.cached_cell_size))
+        self.screen.blit(self.fog_layer, (self.cached_margin_x, self.cached_margin_y))
 
     def draw_game(self, state):
-        if not self.background_surface: self.init_level(state)
+        quality = self.quality.level
+        if (not self.background_surface or self.cached_grid_version != state.grid_version
+                or self.cached_background_scale != self.quality.background_scale): self.init_level(state)
         self.screen.blit(self.background_surface, (0,0))
         
         cell_size = self.cached_cell_size; margin_x = self.cached_margin_x; margin_y = self.cached_margin_y
         
-        for ex in state.explosion_marks:
-             cx = margin_x + ex[1] * cell_size + cell_size//2; cy = margin_y + ex[0] * cell_size + cell_size//2
-             pygame.draw.circle(self.screen, EXPLOSION_MARK, (cx, cy), cell_size * 2)
+        if quality < QUALITY_NO_AURAS:
+            for ex in state.explosion_marks:
+                 cx = margin_x + ex[1] * cell_size + cell_size//2; cy = margin_y + ex[0] * cell_size + cell_size//2
+                 pygame.draw.circle(self.screen, EXPLOSION_MARK, (cx, cy), cell_size * 2)
+
+        # Fog of war: darken what the player can't see and skip drawing anything standing in it
+        seen = state.visible_cells()
+        if seen is not None: self.draw_fog(state, seen)
+        def hidden(pos): return seen is not None and (int(round(pos[0])), int(round(pos[1]))) not in seen
 
-        pulse = math.sin(pygame.time.get_ticks() * 0.01) * 2
+        pulse = math.sin(pygame.time.get_ticks() * 0.01) * 2 if quality < QUALITY_STATIC_REWARDS else 0
         for rew in state.rewards:
+            if hidden(rew['pos']): continue
             r, c = rew['pos']; cx = margin_x + c * cell_size + cell_size // 2; cy = margin_y + r * cell_size + cell_size // 2
             if rew['type'] == 'points':
                 pygame.draw.circle(self.screen, WHITE, (cx, cy), int(cell_size//3 + 3 + pulse)); pygame.draw.circle(self.screen, rew['color'], (cx, cy), int(cell_size//3 + pulse))
@@ -761,26 +1542,30 @@ class GameRenderer:
                 else: pygame.draw.circle(self.screen, rew['color'], (cx, cy), int(cell_size//3))
 
         if state.mode == "vs_ai":
-            if state.key_spawned and not state.has_key:
+            if state.key_spawned and not state.has_key and not hidden(state.key_pos):
                 k_img = self.get_scaled_asset('key', cell_size, cell_size)
                 if k_img: self.screen.blit(k_img, (margin_x + state.key_pos[1]*cell_size, margin_y + state.key_pos[0]*cell_size))
-            if state.heart_spawned and not state.has_shield:
+            if state.heart_spawned and not state.has_shield and not hidden(state.heart_pos):
                 h_img = self.get_scaled_asset('heart', cell_size, cell_size)
                 if h_img: self.screen.blit(h_img, (margin_x + state.heart_pos[1]*cell_size, margin_y + state.heart_pos[0]*cell_size))
 
         tnt_img = self.get_scaled_asset('tnt', cell_size, cell_size)
         for b in state.bombs:
+            if hidden(b['pos']): continue
             bx = margin_x + b['pos'][1] * cell_size; by = margin_y + b['pos'][0] * cell_size
             if tnt_img: self.screen.blit(tnt_img, (bx, by))
             else: pygame.draw.circle(self.screen, BOMB_COLOR, (bx+cell_size//2, by+cell_size//2), cell_size//3)
 
         creeper_img = self.get_scaled_asset('creeper', cell_size, cell_size)
         for creep in state.creepers:
+            if hidden(creep['pos']): continue
             cx = margin_x + creep['pos'][1] * cell_size; cy = margin_y + creep['pos'][0] * cell_size
             radius_px = creep['radius'] * cell_size * 2 + cell_size
-            aura_surf = pygame.Surface((radius_px, radius_px), pygame.SRCALPHA)
-            pygame.draw.circle(aura_surf, CREEPER_AURA, (radius_px//2, radius_px//2), radius_px//2)
-            self.screen.blit(aura_surf, (cx + cell_size//2 - radius_px//2, cy + cell_size//2 - radius_px//2))
+            if quality < QUALITY_NO_AURAS:
+                aura_surf = pygame.Surface((radius_px, radius_px), pygame.SRCALPHA)
+                pygame.draw.circle(aura_surf, CREEPER_AURA, (radius_px//2, radius_px//2), radius_px//2)
+                self.screen.blit(aura_surf, (cx + cell_size//2 - radius_px//2, cy + cell_size//2 - radius_px//2))
+            else: pygame.draw.circle(self.screen, BLACK, (cx + cell_size//2, cy + cell_size//2), radius_px//2, 1) # Just the blast radius
             if creeper_img:
                 if creep['state'] == 'FUSE':
                     blink_speed = max(1, int(creep['fuse'] / 5)) 
@@ -797,11 +1582,12 @@ class GameRenderer:
 
         piglin = self.get_scaled_asset('piglin', cell_size, cell_size)
         for bot in state.bots:
+            if hidden(bot['pos']): continue
             screen_x = margin_x + bot['pos'][1] * cell_size; screen_y = margin_y + bot['pos'][0] * cell_size
             if piglin: self.screen.blit(piglin, (screen_x, screen_y))
             else: pygame.draw.rect(self.screen, HELL_RED, (screen_x+2, screen_y+2, cell_size-4, cell_size-4))
 
-        if state.enderman:
+        if state.enderman and not hidden(state.enderman['pos']):
             enderman_img = self.get_scaled_asset('enderman', cell_size, cell_size)
             ex = margin_x + state.enderman['pos'][1] * cell_size; ey = margin_y + state.enderman['pos'][0] * cell_size
             pygame.draw.rect(self.screen, ENDERMAN_PURPLE, (ex, ey, cell_size, cell_size), 2)
@@ -809,13 +1595,16 @@ class GameRenderer:
 
         ghast_size = int(cell_size * 3.5); ghast_img = self.get_scaled_asset('ghast', ghast_size, ghast_size)
         for g in state.ghasts:
-            shadow_x = margin_x + g['pos'][1] * cell_size + cell_size//2; shadow_y = margin_y + g['pos'][0] * cell_size + UI_HEIGHT + cell_size 
-            pygame.draw.circle(self.screen, GHAST_SHADOW, (int(shadow_x), int(shadow_y)), cell_size//2)
+            if hidden(g['pos']): continue
+            if quality < QUALITY_NO_AURAS:
+                shadow_x = margin_x + g['pos'][1] * cell_size + cell_size//2; shadow_y = margin_y + g['pos'][0] * cell_size + UI_HEIGHT + cell_size 
+                pygame.draw.circle(self.screen, GHAST_SHADOW, (int(shadow_x), int(shadow_y)), cell_size//2)
             screen_gx = margin_x + g['pos'][1] * cell_size - ghast_size//2; screen_gy = margin_y + g['pos'][0] * cell_size - ghast_size//2
             if ghast_img: self.screen.blit(ghast_img, (screen_gx, screen_gy))
 
         fire_img = self.get_scaled_asset('fire_charge', cell_size, cell_size)
         for fc in state.fire_charges:
+            if hidden(fc['pos']): continue
             fx = margin_x + fc['pos'][1] * cell_size; fy = margin_y + fc['pos'][0] * cell_size
             if fire_img: self.screen.blit(fire_img, (fx, fy))
             else: pygame.draw.circle(self.screen, ORANGE, (int(fx+cell_size//2), int(fy+cell_size//2)), cell_size//3)
@@ -826,7 +1615,8 @@ class GameRenderer:
         else: pygame.draw.rect(self.screen, CYAN, (p_x+3, p_y+3, cell_size-6, cell_size-6))
 
         gx, gy = state.goal_pos; portal = self.get_scaled_asset('portal', cell_size, cell_size); g_x = margin_x + gy * cell_size; g_y = margin_y + gx * cell_size
-        if portal: self.screen.blit(portal, (g_x, g_y))
+        if state.endless: pass
+        elif portal: self.screen.blit(portal, (g_x, g_y))
         else: pygame.draw.rect(self.screen, GREEN, (g_x, g_y, cell_size, cell_size))
         
         if state.mode == "vs_ai" and not state.has_key: pygame.draw.rect(self.screen, WHITE, (g_x, g_y, cell_size, cell_size), 3)
@@ -844,8 +1634,12 @@ class GameRenderer:
         if state.mode == "solo": status = f"Steps: {len(state.path_taken)} | 'P' to Pause"
         elif state.mode == "vs_ai": status = f"YOU: {state.user_score} | AI: {state.bots[0]['score'] if state.bots else 0}"
         elif state.mode == "hell": status = f"Score: {state.user_score} | Pearls(1): {state.pearl_count}/5 | Drink(2): {'Ready' if state.has_energy_drink else 'Empty'}"
+        if state.endless: status += f" | Depth: {state.depth + state.player_pos[0]}"
+        if self.rewind: rewind = self.rewind.stats(); status += f" | Rewind: {rewind['seconds']:.0f}s {rewind['bytes'] // 1024} KB"
         
         txt = self.font_ui.render(status, True, WHITE); self.screen.blit(txt, (20, (UI_HEIGHT - txt.get_height())//2))
+        if quality > QUALITY_FULL:
+            fx = self.font_ui.render(f"FX: {self.quality.name}", True, YELLOW); self.screen.blit(fx, (SCREEN_WIDTH - fx.get_width() - 20, (UI_HEIGHT - fx.get_height())//2))
         
         if state.mode == "vs_ai":
             icon_x = 400
@@ -858,7 +1652,7 @@ class GameRenderer:
                 if h_icon: self.screen.blit(h_icon, (icon_x, (UI_HEIGHT-30)//2))
 
         if state.is_warming_up:
-            rem = (state.warmup_duration - (pygame.time.get_ticks() - state.start_ticks)) // 1000 + 1
+            rem = (state.warmup_timer + FPS - 1) // FPS
             txt = "GO!" if rem <= 0 else str(int(rem)); surf = self.font_huge.render(txt, True, COUNTDOWN_COLOR)
             self.screen.blit(surf, (SCREEN_WIDTH//2 - surf.get_width()//2, SCREEN_HEIGHT//2 - surf.get_height()//2))
         elif state.paused: self.draw_overlay("PAUSED", "Press 'P' to Resume | 'R' to Menu")
@@ -869,8 +1663,10 @@ class GameRenderer:
              self.draw_overlay(state.game_over_text, "Press 'R' to Return to Menu", use_win_gif, state.death_type)
 
     def draw_overlay(self, title_text, sub_text, show_win_gif=False, death_type=None):
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA); overlay.fill(OVERLAY_BG); self.screen.blit(overlay, (0,0))
         cx, cy = SCREEN_WIDTH//2, SCREEN_HEIGHT//2
+        if self.quality.level < QUALITY_CHEAP_OVERLAYS:
+            overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA); overlay.fill(OVERLAY_BG); self.screen.blit(overlay, (0,0))
+        else: pygame.draw.rect(self.screen, BLACK, (0, cy - SCREEN_HEIGHT // 3, SCREEN_WIDTH, SCREEN_HEIGHT * 2 // 3)) # Opaque band, no full-screen blend
         asset_to_show = None; is_static = False
         if show_win_gif is True: asset_to_show = 'win'
         elif death_type == "explosion":
@@ -917,7 +1713,8 @@ class GameRenderer:
         opt_alpha = min(255, max(0, (time_elapsed - 2000) // 4)) if time_elapsed > 2000 else 0
         tips_alpha = min(255, max(0, (time_elapsed - 3000) // 4)) if time_elapsed > 3000 else 0
         
-        # Draw base black overlay if fading in
+        # Draw base black overlay if fading in (skipped when frames are tight: the menu just appears)
+        if self.quality.level >= QUALITY_CHEAP_OVERLAYS: bg_fade = 0; title_alpha = opt_alpha = tips_alpha = 255
         if bg_fade > 0:
             fade_s = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)); fade_s.fill(BLACK); fade_s.set_alpha(bg_fade)
             self.screen.blit(fade_s, (0,0))
@@ -935,6 +1732,7 @@ class GameRenderer:
             # Pulse/Rotate splash
             scale = 1.0 + math.sin(pygame.time.get_ticks() * 0.004) * 0.05
             angle = math.sin(pygame.time.get_ticks() * 0.008) * 5
+            if self.quality.level >= QUALITY_STATIC_REWARDS: scale, angle = 1.0, 0
             
             # Create surface for text with outline
             splash_base = self.font_splash.render(menu_state.splash_text, True, YELLOW)
@@ -959,11 +1757,14 @@ class GameRenderer:
             self.screen.blit(splash_rot, (50 + title_s.get_width() - 20, 100))
 
         # 4. Draw Options (Left Aligned)
+        # Below the title, squeezed to fit however many options there are into the logical height
+        menu_top = min(300, SCREEN_HEIGHT // 3)
+        pitch = min(80, (SCREEN_HEIGHT - menu_top - 20) // len(menu_state.options))
         if opt_alpha > 0:
-            start_y = 300
+            start_y = menu_top
             for i, opt in enumerate(menu_state.options):
                 # Button Rect
-                btn_w, btn_h = 400, 60
+                btn_w, btn_h = 400, min(60, pitch - 10)
                 btn_x, btn_y = 100, start_y
                 btn_rect = pygame.Rect(btn_x, btn_y, btn_w, btn_h)
                 
@@ -993,13 +1794,13 @@ class GameRenderer:
                 txt_rect = txt_s.get_rect(center=btn_rect.center)
                 self.screen.blit(txt_s, txt_rect)
                 
-                start_y += 80
+                start_y += pitch
 
         # 5. Draw Tips (Right Aligned Box)
         if tips_alpha > 0:
             box_w, box_h = 320, 150
             box_x = SCREEN_WIDTH - box_w - 50
-            box_y = 300
+            box_y = menu_top
             
             # Draw semi-transparent box
             box_s = pygame.Surface((box_w, box_h), pygame.SRCALPHA)
@@ -1033,57 +1834,106 @@ class GameRenderer:
                 self.screen.blit(l_s, (box_x + 10, text_y))
                 text_y += 30
 
+# Menu index -> (rows, mode, endless, fog of war)
+LEVEL_PRESETS = [(12, "solo", False, False), (18, "solo", False, False), (25, "solo", False, False), (25, "vs_ai", False, False),
+                 (25, "hell", False, False), (25, "hell", True, False), (25, "hell", False, True)]
+
+# Keys that become one-shot input bits while playing
+INPUT_KEYS = {pygame.K_p: INPUT_PAUSE, pygame.K_1: INPUT_PEARL, pygame.K_2: INPUT_DRINK}
+
+def held_input_bits(keys):
+    bits = 0
+    if keys[pygame.K_LEFT]: bits |= INPUT_LEFT
+    if keys[pygame.K_RIGHT]: bits |= INPUT_RIGHT
+    if keys[pygame.K_UP]: bits |= INPUT_UP
+    if keys[pygame.K_DOWN]: bits |= INPUT_DOWN
+    return bits
+
 # --- MAIN LOOP ---
 if __name__ == "__main__":
+    import argparse, os
+    parser = argparse.ArgumentParser(description="Mabrook's Maze: Nether Update")
+    parser.add_argument("--record", metavar="DIR", help="save a replay of every game into DIR (play back with replay.py)")
+    parser.add_argument("--rewind", type=float, default=0, metavar="SECONDS", help="keep the last SECONDS of play; hold Backspace to rewind")
+    parser.add_argument("--logical", metavar="WxH", help="draw at this fixed resolution (e.g. 1280x720) and upscale to the monitor")
+    parser.add_argument("--integer-scale", action="store_true", help="with --logical, upscale by whole multiples only (sharp pixels, letterboxed)")
+    parser.add_argument("--quality", choices=("auto",) + QUALITY_NAMES, default="auto", help="effects level; auto steps it to hold the frame rate")
+    parser.add_argument("--lookahead-budget", type=int, default=LOOKAHEAD_BUDGET, metavar="FRAMES",
+                        help="simulated frames the lookahead VS bot may run per frame (stored in replays)")
+    parser.add_argument("--telemetry", metavar="PATH", help="append health samples as JSON lines to PATH (or a socket: unix:PATH), see telemetry.py")
+    parser.add_argument("--telemetry-malloc", action="store_true", help="also trace allocations and list the top allocators; several times slower, so timings are marked")
+    parser.add_argument("--opponent", choices=LEVEL_OPPONENTS, default="greedy", help="VS AI bot: greedy, or lookahead (plans on cloned games)")
+    args = parser.parse_args()
+    if args.record: os.makedirs(args.record, exist_ok=True)
+    recorder = None
+    rewind = None
+    telemetry = None
+    if args.telemetry:
+        from telemetry import Telemetry
+        telemetry = Telemetry(args.telemetry, malloc_top=10 if args.telemetry_malloc else 0).instrument(GameState, BotPlanner)
+
+    def finish_recording():
+        global recorder
+        if recorder and recorder.frames:
+            recorder.save(os.path.join(args.record, f"{time.strftime('%Y%m%d-%H%M%S')}-{game.mode}-{game.seed}.rpl"), game)
+        recorder = None
+
+    if args.logical: set_logical_resolution(*map(int, args.logical.lower().split("x")), integer_scale=args.integer_scale)
     renderer = GameRenderer(screen)
+    if args.quality != "auto": renderer.quality.level = QUALITY_NAMES.index(args.quality)
+    factory = LevelFactory(renderer, opponent=args.opponent, lookahead_budget=args.lookahead_budget)
     menu = MenuState()
     game = None 
+    game_preset = None
     
     while True:
         clock.tick(FPS)
+        frame_start = time.perf_counter()
         
         events = pygame.event.get()
+        input_bits = 0
         for event in events:
             if event.type == pygame.QUIT:
-                pygame.quit(); sys.exit()
+                if game: finish_recording()
+                factory.shutdown(); telemetry and telemetry.close(); pygame.quit(); sys.exit()
             
             if game:
                 # GAME INPUT
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
-                        if game: game = None; menu = MenuState() # Reset menu state on return
-                    if event.key == pygame.K_p: game.paused = not game.paused
+                        finish_recording(); game = None; menu = MenuState() # Reset menu state on return
                     elif event.key == pygame.K_r:
-                        if game.paused or not game.game_active or game.game_won: game = None; menu = MenuState()
-                    elif event.key == pygame.K_1 and game.mode == "hell": game.use_pearl()
-                    elif event.key == pygame.K_2 and game.mode == "hell": game.use_energy_drink()
+                        if game.paused or not game.game_active or game.game_won: finish_recording(); game = None; menu = MenuState()
+                    else: input_bits |= INPUT_KEYS.get(event.key, 0)
             else:
                 # MENU INPUT
                 if event.type == pygame.KEYDOWN:
                     choice = menu.handle_input(event)
                     if choice is not None:
-                        if choice == 0: game = GameState(12, "solo")
-                        elif choice == 1: game = GameState(18, "solo")
-                        elif choice == 2: game = GameState(25, "solo")
-                        elif choice == 3: game = GameState(25, "vs_ai")
-                        elif choice == 4: game = GameState(25, "hell")
-                        elif choice == 5: pygame.quit(); sys.exit()
-                        
-                        if game: renderer.init_level(game)
+                        if choice < len(LEVEL_PRESETS):
+                            game_preset = LEVEL_PRESETS[choice]
+                            game, prepared = factory.take(game_preset)
+                            renderer.init_level(game, prepared)
+                            if args.record: recorder = ReplayRecorder(game)
+                            rewind = renderer.rewind = RewindBuffer(args.rewind) if args.rewind and not game.endless else None
+                        else: factory.shutdown(); telemetry and telemetry.close(); pygame.quit(); sys.exit()
+
+        # Cook the level the player is most likely to start next while nothing else is going on
+        if game is None and menu.selected_index < len(LEVEL_PRESETS): factory.prefetch(LEVEL_PRESETS[menu.selected_index])
+        elif game and (not game.game_active or game.game_won): factory.prefetch(game_preset)
 
         # GAME UPDATE
         if game:
-            if not game.paused and game.game_active:
-                keys = pygame.key.get_pressed()
-                if game.move_timer > 0: game.move_timer -= 1
-                else:
-                    dx, dy = 0, 0
-                    if keys[pygame.K_LEFT]: dx = -1
-                    elif keys[pygame.K_RIGHT]: dx = 1
-                    elif keys[pygame.K_UP]: dy = -1
-                    elif keys[pygame.K_DOWN]: dy = 1
-                    if dx != 0 or dy != 0: game.move_player(dx, dy); game.move_timer = game.move_delay
-            game.update()
+            keys = pygame.key.get_pressed()
+            if rewind and keys[pygame.K_BACKSPACE]:
+                # Scrub back at double speed; a recording forgets the undone frames so it still replays
+                undone = rewind.step_back(game, 2)
+                if recorder: recorder.truncate(recorder.frames - undone)
+            else:
+                input_bits |= held_input_bits(keys)
+                if recorder: recorder.record(input_bits)
+                game.step(input_bits)
+                if rewind: rewind.record(game)
             renderer.draw_game(game)
         
         # MENU UPDATE
@@ -1091,4 +1941,9 @@ if __name__ == "__main__":
             menu.update()
             renderer.draw_menu_new(menu)
             
-        pygame.display.flip()
\ No newline at end of file
+        present()
+        frame_seconds = time.perf_counter() - frame_start
+        if args.quality == "auto": renderer.quality.record(frame_seconds)
+        if telemetry:
+            if game and rewind: telemetry.frame(game, frame_seconds, quality=renderer.quality.name, rewind=rewind.stats())
+            else: telemetry.frame(game, frame_seconds, quality=renderer.quality.name)
\ No newline at end of file
@@ -0,0 +1,868 @@
+import heapq
+import random
+import itertools
+import mmap
+import struct
+from collections import OrderedDict
+
+# --- MAZE GENERATORS ---
+# Every generator carves passages into a grid of 1s (walls) using the usual
+# lattice layout: cells live on odd (row, col) coordinates and the even
+# coordinates between two cells are the walls that may be knocked out.
+
+class MazeGenerator:
+    """Base class for the maze carving algorithms."""
+    name = "base"
+
+    def generate(self, grid, rows, cols, start_r=1, start_c=1, rng=random):
+        raise NotImplementedError
+
+    @staticmethod
+    def lattice_size(rows, cols):
+        return (rows - 1) // 2, (cols - 1) // 2
+
+
+class BacktrackerGenerator(MazeGenerator):
+    """Iterative randomized depth-first search. Long winding corridors."""
+    name = "backtracker"
+    # All 24 orders of the four directions, picked with one random call per step
+    ORDERS = list(itertools.permutations(((0, 1), (0, -1), (1, 0), (-1, 0))))
+
+    def generate(self, grid, rows, cols, start_r=1, start_c=1, rng=random):
+        h, w = self.lattice_size(rows, cols)
+        if h <= 0 or w <= 0: return
+        orders = self.ORDERS; n_orders = len(orders); rand = rng.random
+        visited = bytearray(h * w)
+        si, sj = min(h - 1, max(0, (start_r - 1) // 2)), min(w - 1, max(0, (start_c - 1) // 2))
+        visited[si * w + sj] = 1
+        grid[2 * si + 1][2 * sj + 1] = 0
+        stack = [(si, sj)]
+        while stack:
+            i, j = stack[-1]
+            for di, dj in orders[int(rand() * n_orders)]:
+                ni, nj = i + di, j + dj
+                if 0 <= ni < h and 0 <= nj < w and not visited[ni * w + nj]:
+                    visited[ni * w + nj] = 1
+                    grid[2 * i + 1 + di][2 * j + 1 + dj] = 0
+                    grid[2 * ni + 1][2 * nj + 1] = 0
+                    stack.append((ni, nj))
+                    break
+            else: stack.pop()
+
+
+class KruskalGenerator(MazeGenerator):
+    """Randomized Kruskal over all lattice walls with a union-find forest. Short, branchy corridors."""
+    name = "kruskal"
+
+    def generate(self, grid, rows, cols, start_r=1, start_c=1, rng=random):
+        h, w = self.lattice_size(rows, cols)
+        if h <= 0 or w <= 0: return
+        for i in range(h):
+            row = grid[2 * i + 1]
+            for j in range(w): row[2 * j + 1] = 0
+
+        # Edge k < horizontal joins cell k with k + 1, the rest join k with k + w
+        horizontal = [i * w + j for i in range(h) for j in range(w - 1)]
+        vertical = [i * w + j for i in range(h - 1) for j in range(w)]
+        edges = [(k, 1) for k in horizontal] + [(k, w) for k in vertical]
+        rng.shuffle(edges)
+
+        parent = list(range(h * w))
+        remaining = h * w - 1
+        for a, step in edges:
+            b = a + step
+            ra = a
+            while parent[ra] != ra: parent[ra] = parent[parent[ra]]; ra = parent[ra]
+            rb = b
+            while parent[rb] != rb: parent[rb] = parent[parent[rb]]; rb = parent[rb]
+            if ra == rb: continue
+            parent[rb] = ra
+            i, j = divmod(a, w)
+            if step == 1: grid[2 * i + 1][2 * j + 2] = 0
+            else: grid[2 * i + 2][2 * j + 1] = 0
+            remaining -= 1
+            if remaining == 0: break
+
+
+class WilsonGenerator(MazeGenerator):
+    """Wilson's loop-erased random walks. Uniform spanning tree, no directional bias."""
+    name = "wilson"
+    DIRS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+
+    def generate(self, grid, rows, cols, start_r=1, start_c=1, rng=random):
+        h, w = self.lattice_size(rows, cols)
+        if h <= 0 or w <= 0: return
+        dirs = self.DIRS; rand = rng.random
+        in_tree = bytearray(h * w)
+        # Exit direction of the latest visit; overwriting it is what erases loops
+        exit_dir = bytearray(h * w)
+        si, sj = min(h - 1, max(0, (start_r - 1) // 2)), min(w - 1, max(0, (start_c - 1) // 2))
+        in_tree[si * w + sj] = 1
+        grid[2 * si + 1][2 * sj + 1] = 0
+
+        order = list(range(h * w))
+        rng.shuffle(order)
+        for start in order:
+            if in_tree[start]: continue
+            # 1. Random walk until the tree is hit
+            i, j = divmod(start, w)
+            while not in_tree[i * w + j]:
+                while True:
+                    d = int(rand() * 4); di, dj = dirs[d]
+                    if 0 <= i + di < h and 0 <= j + dj < w: break
+                exit_dir[i * w + j] = d
+                i += di; j += dj
+            # 2. Carve the loop-erased path into the tree
+            i, j = divmod(start, w)
+            while not in_tree[i * w + j]:
+                in_tree[i * w + j] = 1
+                di, dj = dirs[exit_dir[i * w + j]]
+                grid[2 * i + 1][2 * j + 1] = 0
+                grid[2 * i + 1 + di][2 * j + 1 + dj] = 0
+                i += di; j += dj
+
+
+class EllerGenerator(MazeGenerator):
+    """Eller's algorithm. Builds one row at a time, so memory only depends on the width."""
+    name = "eller"
+
+    def generate(self, grid, rows, cols, start_r=1, start_c=1, rng=random):
+        h, _ = self.lattice_size(rows, cols)
+        if h <= 0: return
+        for r, row in enumerate(self.iter_rows(cols, h, rng)): grid[r][:] = row
+
+    def iter_rows(self, cols, cell_rows=None, rng=random):
+        """Yields finished grid rows top to bottom, borders included. Endless if cell_rows is None."""
+        w = (cols - 1) // 2
+        rand = rng.random
+        yield [1] * cols
+        if w <= 0: return
+        sets = [None] * w
+        next_id = 0
+        done = 0
+        while cell_rows is None or done < cell_rows:
+            last = cell_rows is not None and done == cell_rows - 1
+            for j in range(w):
+                if sets[j] is None: sets[j] = next_id; next_id += 1
+
+            # 1. Join neighbours that belong to different sets
+            parent = {}
+            def find(x):
+                while parent.get(x, x) != x:
+                    x = parent[x]
+                return x
+            passage = [1] * cols
+            for j in range(w): passage[2 * j + 1] = 0
+            for j in range(w - 1):
+                a, b = find(sets[j]), find(sets[j + 1])
+                if a != b and (last or rand() < 0.5):
+                    parent[b] = a
+                    passage[2 * j + 2] = 0
+            for j in range(w): sets[j] = find(sets[j])
+            yield passage
+
+            # 2. Every set drops at least one passage into the row below
+            divider = [1] * cols
+            if last:
+                yield divider
+                return
+            members = {}
+            for j in range(w): members.setdefault(sets[j], []).append(j)
+            below = [None] * w
+            for set_id, cells in members.items():
+                down = [j for j in cells if rand() < 0.5]
+                if not down: down = [cells[int(rand() * len(cells))]]
+                for j in down:
+                    below[j] = set_id
+                    divider[2 * j + 1] = 0
+            sets = below
+            done += 1
+            yield divider
+
+
+MAZE_GENERATORS = {
+    BacktrackerGenerator.name: BacktrackerGenerator,
+    KruskalGenerator.name: KruskalGenerator,
+    WilsonGenerator.name: WilsonGenerator,
+    EllerGenerator.name: EllerGenerator,
+}
+
+def get_generator(name):
+    if name not in MAZE_GENERATORS:
+        raise ValueError(f"Unknown maze generator '{name}'. Choose from: {', '.join(MAZE_GENERATORS)}")
+    return MAZE_GENERATORS[name]()
+
+def make_grid(rows, cols):
+    return [[1] * cols for _ in range(rows)]
+
+def carve_loops(grid, rows, cols, count, rng=random, r_min=1, r_max=None):
+    """Opens up to `count` walls that sit between two corridors, so every removal creates a real loop.
+
+    Only rows r_min..r_max are touched. Returns the opened cells."""
+    opened = []
+    if r_max is None: r_max = rows - 2
+    r_min = max(1, r_min); r_max = min(rows - 2, r_max)
+    if r_max < r_min or cols < 3: return opened
+    randint = rng.randint
+    attempts = 0
+    while len(opened) < count and attempts < count * 8:
+        attempts += 1
+        r = randint(r_min, r_max); c = randint(1, cols - 2)
+        if grid[r][c] == 0: continue
+        up, down, left, right = grid[r - 1][c], grid[r + 1][c], grid[r][c - 1], grid[r][c + 1]
+        if (up == 0 and down == 0 and left == 1 and right == 1) or (left == 0 and right == 0 and up == 1 and down == 1):
+            grid[r][c] = 0
+            opened.append((r, c))
+    return opened
+
+
+class MazeStream:
+    """Endless supply of maze rows from Eller's algorithm. Keeps only one row of set state."""
+    def __init__(self, cols, rng=random):
+        self.cols = cols
+        self.rows_made = 0
+        self._rows = EllerGenerator().iter_rows(cols, None, rng)
+
+    def take(self, count):
+        self.rows_made += count
+        return [next(self._rows) for _ in range(count)]
+
+
+# --- LEVEL FILES ---
+# Layout (little endian):
+#   header  : magic, version, mode, flags, rows, cols, entity count, seed
+#   entities: entity count fixed-size records (kind, variant, value, r, c, r2, c2)
+#   grid    : one bit per cell, 1 = wall, MSB first, each row padded to a whole byte
+MAZE_MAGIC = b"SMAZ"
+MAZE_VERSION = 1
+HEADER = struct.Struct("<4sHBBIIIQ")
+ENTITY = struct.Struct("<BBxxiiiii")
+_BITS_TO_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+_DIGITS_TO_BITS = bytes.maketrans(b"01", b"\x00\x01")
+
+def _row_stride(cols):
+    return (cols + 7) // 8
+
+def pack_row(row, stride):
+    digits = bytes(row).translate(_BITS_TO_DIGITS).ljust(stride * 8, b"0")
+    return int(digits, 2).to_bytes(stride, "big")
+
+def unpack_row(data, cols, stride):
+    digits = format(int.from_bytes(data, "big"), f"0{stride * 8}b").encode()
+    return list(digits[:cols].translate(_DIGITS_TO_BITS))
+
+def write_maze_file(path, grid, mode=0, flags=0, seed=0, entities=()):
+    rows, cols = len(grid), len(grid[0])
+    stride = _row_stride(cols)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAZE_MAGIC, MAZE_VERSION, mode, flags, rows, cols, len(entities), seed))
+        for entity in entities: f.write(ENTITY.pack(*entity))
+        f.write(b"".join(pack_row(row, stride) for row in grid))
+
+class MazeFile:
+    """Memory-mapped level file. cell() reads straight out of the mapping without copying; row() and to_grid()
+    unpack copies, for callers that need a mutable grid."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.mode, self.flags, self.rows, self.cols, count, self.seed = HEADER.unpack_from(self._map, 0)
+        if magic != MAZE_MAGIC: raise ValueError(f"{path} is not a maze file")
+        if version != MAZE_VERSION: raise ValueError(f"{path} has unsupported maze file version {version}")
+        self.entities = [ENTITY.unpack_from(self._map, HEADER.size + i * ENTITY.size) for i in range(count)]
+        self.stride = _row_stride(self.cols)
+        self.grid_offset = HEADER.size + count * ENTITY.size
+        if len(self._map) < self.grid_offset + self.rows * self.stride: raise ValueError(f"{path} is truncated")
+        self._view = memoryview(self._map)
+
+    def cell(self, r, c):
+        return (self._map[self.grid_offset + r * self.stride + (c >> 3)] >> (7 - (c & 7))) & 1
+
+    def row(self, r):
+        start = self.grid_offset + r * self.stride
+        return unpack_row(self._view[start:start + self.stride], self.cols, self.stride)
+
+    def to_grid(self):
+        return [self.row(r) for r in range(self.rows)]
+
+    def close(self):
+        self._view.release(); self._map.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+
+
+# --- PATHFINDING ---
+NEIGHBOURS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+
+def grid_astar_path(grid, start, end, stats=None):
+    """Plain cell-by-cell A*, the reference the faster pathfinders are checked and benchmarked against."""
+    rows, cols = len(grid), len(grid[0])
+    start, end = tuple(start), tuple(end)
+    queue = [(0, 0, start, [start])]; visited = set()
+    while queue:
+        f, g, current, path = heapq.heappop(queue)
+        if current == end: break
+        if current in visited: continue
+        visited.add(current)
+        for dr, dc in NEIGHBOURS:
+            nr, nc = current[0] + dr, current[1] + dc
+            if 0 <= nr < rows and 0 <= nc < cols and grid[nr][nc] == 0:
+                h = abs(nr - end[0]) + abs(nc - end[1])
+                heapq.heappush(queue, (g + 1 + h, g + 1, (nr, nc), path + [(nr, nc)]))
+    else: path = []
+    if stats is not None: stats['expansions'] = stats.get('expansions', 0) + len(visited)
+    return path
+
+class CorridorGraph:
+    """Junction graph of a maze. Nodes are dead ends, junctions and carved loop cells; edges are the
+    one-cell-wide corridors between them, stored with their length so a search only touches junctions."""
+    def __init__(self, grid, extra_nodes=()):
+        self.grid = grid
+        self.rows, self.cols = len(grid), len(grid[0])
+        self.extra_nodes = set(extra_nodes)
+        self.edges = {} # node -> {first step: (end node, length, step before end)}
+        self.expansions = 0
+        self._build()
+
+    # 1. Structure
+    def _open(self, r, c):
+        return 0 <= r < self.rows and 0 <= c < self.cols and self.grid[r][c] == 0
+
+    def _open_neighbours(self, r, c):
+        return [(r + dr, c + dc) for dr, dc in NEIGHBOURS if self._open(r + dr, c + dc)]
+
+    def _is_node(self, r, c):
+        if not self._open(r, c): return False
+        return (r, c) in self.extra_nodes or len(self._open_neighbours(r, c)) != 2
+
+    def _build(self):
+        grid = self.grid
+        for r in range(self.rows):
+            row = grid[r]
+            for c in range(self.cols):
+                if row[c] == 0 and self._is_node(r, c): self.edges[(r, c)] = {}
+        for node in self.edges: self._trace_from(node)
+
+    def _walk(self, prev, cur):
+        """Follows a corridor from cell `cur` (entered from `prev`) until a node. Returns (node, cell before it, steps, cells)."""
+        cells = []
+        start = cur; steps = 1
+        while cur not in self.edges:
+            cells.append(cur)
+            nxt = [n for n in self._open_neighbours(*cur) if n != prev]
+            if not nxt: return None
+            prev, cur = cur, nxt[0]; steps += 1
+            if cur == start: return None # Closed loop with no junction on it
+        return cur, prev, steps, cells
+
+    def _trace_from(self, node):
+        links = self.edges[node]
+        for first in self._open_neighbours(*node):
+            if first in links: continue
+            walked = self._walk(node, first)
+            if walked is None: continue
+            end, last, length, _ = walked
+            links[first] = (end, length, last)
+            self.edges[end][last] = (node, length, first)
+
+    # 2. Local updates
+    def patch(self, changes):
+        """Applies (r, c, value) grid changes and re-traces only the corridors that run through them."""
+        touched = set()
+        for r, c, _ in changes:
+            touched.add((r, c))
+            for dr, dc in NEIGHBOURS: touched.add((r + dr, c + dc))
+        touched = {p for p in touched if 0 <= p[0] < self.rows and 0 <= p[1] < self.cols}
+
+        # Drop every node and corridor that passes through a touched cell, remembering the survivors' ends
+        dirty = set()
+        def unlink(node, first):
+            link = self.edges[node].pop(first, None)
+            if link is None: return # Already gone from its other end: a corridor that starts and ends at one node
+            end, _, last = link
+            if end in self.edges: self.edges[end].pop(last, None); dirty.add(end)
+            dirty.add(node)
+        for cell in touched:
+            if cell not in self.edges and self._open(*cell):
+                for first in self._open_neighbours(*cell):
+                    walked = self._walk(cell, first)
+                    if walked is None: continue
+                    end, last, _, _ = walked
+                    if last in self.edges[end]: unlink(end, last)
+        for cell in touched:
+            if cell in self.edges:
+                for first in list(self.edges[cell]): unlink(cell, first)
+                del self.edges[cell]
+
+        for r, c, value in changes:
+            self.grid[r][c] = value
+            if value == 1: self.extra_nodes.discard((r, c))
+
+        for cell in touched:
+            if self._is_node(*cell): self.edges[cell] = {}; dirty.add(cell)
+        for node in dirty:
+            if node in self.edges: self._trace_from(node)
+
+    # 3. Queries
+    def _anchors(self, cell):
+        """Nodes reachable from a cell without passing another node: [(node, steps, first step taken, cells before node)]."""
+        if cell in self.edges: return [(cell, 0, None, [])]
+        anchors = []
+        for first in self._open_neighbours(*cell):
+            walked = self._walk(cell, first)
+            if walked is None: return self._promote(cell) # A ring with no junction on it
+            end, _, steps, cells = walked
+            anchors.append((end, steps, first, cells))
+        return anchors
+
+    def _promote(self, cell):
+        """Makes a cell a node, so a corridor that closes on itself (left by a patch) can be searched."""
+        self.extra_nodes.add(cell); self.edges[cell] = {}
+        self._trace_from(cell)
+        return [(cell, 0, None, [])]
+
+    def expand(self, node, first):
+        """Cells of the corridor leaving `node` through `first`, ending with the node at the far end."""
+        end, _, _, cells = self._walk(node, first)
+        return cells + [end]
+
+    def find_path(self, start, goal):
+        """Shortest path as a list of cells from start to goal inclusive, or [] if there is none."""
+        start, goal = tuple(start), tuple(goal)
+        if not self._open(*goal): return []
+        if start == goal: return [start]
+
+        best = float('inf'); best_path = None
+        start_anchors = self._anchors(start)
+        goal_anchors = {}
+        for node, steps, first, cells in self._anchors(goal):
+            if node not in goal_anchors or steps < goal_anchors[node][0]: goal_anchors[node] = (steps, cells)
+        # Start and goal on the same corridor
+        for node, steps, first, cells in start_anchors:
+            if goal in cells:
+                direct = cells.index(goal) + 1
+                if direct < best: best = direct; best_path = [start] + cells[:direct]
+
+        gr, gc = goal
+        heap = []; g_score = {}; parent = {}
+        for node, steps, first, cells in start_anchors:
+            if steps < g_score.get(node, float('inf')):
+                g_score[node] = steps; parent[node] = (None, cells)
+                heapq.heappush(heap, (steps + abs(node[0] - gr) + abs(node[1] - gc), steps, node))
+        best_node = None
+        closed = set()
+        while heap:
+            f, g, node = heapq.heappop(heap)
+            if f >= best: break
+            if node in closed: continue
+            closed.add(node)
+            self.expansions += 1
+            if node in goal_anchors and g + goal_anchors[node][0] < best:
+                best = g + goal_anchors[node][0]; best_node = node
+            for first, (end, length, _) in self.edges[node].items():
+                # A dead end is never on the way to anywhere else
+                if len(self.edges[end]) == 1 and end not in goal_anchors: continue
+                ng = g + length
+                if ng < g_score.get(end, float('inf')):
+                    g_score[end] = ng; parent[end] = (node, first)
+                    heapq.heappush(heap, (ng + abs(end[0] - gr) + abs(end[1] - gc), ng, end))
+
+        if best_node is None: return best_path or []
+        # Expand corridors only for the winning route
+        chain = []
+        node = best_node
+        while True:
+            prev, via = parent[node]
+            chain.append((prev, via, node))
+            if prev is None: break
+            node = prev
+        path = [start]
+        for prev, via, node in reversed(chain):
+            if prev is None: path.extend(via + [node] if node != start else [])
+            else: path.extend(self.expand(prev, via))
+        steps, cells = goal_anchors[best_node]
+        path.extend(reversed(cells))
+        if path[-1] != goal: path.append(goal)
+        return path
+
+
+class HierarchicalPathfinder:
+    """HPA*: the maze is cut into cluster_size x cluster_size chunks joined by entrance cells. Long queries
+    search the small abstract graph of entrances and only then refine each hop inside a single chunk."""
+    def __init__(self, grid, cluster_size=16):
+        self.grid = grid
+        self.rows, self.cols = len(grid), len(grid[0])
+        self.size = cluster_size
+        self.cluster_rows = (self.rows + cluster_size - 1) // cluster_size
+        self.cluster_cols = (self.cols + cluster_size - 1) // cluster_size
+        self.borders = {}  # (cluster, 'h' | 'v') -> [(cell inside, cell across)] towards the right / lower neighbour
+        self.inter = {}    # entrance -> set of entrances across a border
+        self.intra = {}    # cluster -> {entrance: {entrance: cost}}
+        self.dirty = set()
+        self.expansions = 0
+        self.segments = OrderedDict() # (entrance, entrance) -> refined cells, most recently used last
+        self.segment_cache_size = 4096
+        for ci in range(self.cluster_rows):
+            for cj in range(self.cluster_cols):
+                self._scan_border((ci, cj), 'h'); self._scan_border((ci, cj), 'v')
+        for ci in range(self.cluster_rows):
+            for cj in range(self.cluster_cols): self._link_cluster((ci, cj))
+
+    # 1. Structure
+    def cluster_of(self, cell):
+        return cell[0] // self.size, cell[1] // self.size
+
+    def _bounds(self, cid):
+        r0, c0 = cid[0] * self.size, cid[1] * self.size
+        return r0, min(r0 + self.size, self.rows), c0, min(c0 + self.size, self.cols)
+
+    def _scan_border(self, cid, axis):
+        """Finds the entrances between a cluster and its right ('h') or lower ('v') neighbour, one per open run."""
+        r0, r1, c0, c1 = self._bounds(cid)
+        if axis == 'h':
+            if c1 >= self.cols: return
+            pairs = [((r, c1 - 1), (r, c1)) for r in range(r0, r1)]
+        else:
+            if r1 >= self.rows: return
+            pairs = [((r1 - 1, c), (r1, c)) for c in range(c0, c1)]
+        grid = self.grid
+        links = []; run = []
+        for a, b in pairs + [(None, None)]:
+            if a is not None and grid[a[0]][a[1]] == 0 and grid[b[0]][b[1]] == 0: run.append((a, b)); continue
+            if run: links.append(run[len(run) // 2]); run = []
+        self.borders[(cid, axis)] = links
+        for a, b in links:
+            self.inter.setdefault(a, set()).add(b); self.inter.setdefault(b, set()).add(a)
+
+    def _drop_border(self, cid, axis):
+        for a, b in self.borders.pop((cid, axis), []):
+            for x, y in ((a, b), (b, a)):
+                partners = self.inter.get(x)
+                if partners is None: continue
+                partners.discard(y)
+                if not partners: del self.inter[x]
+
+    def _entrances(self, cid):
+        ci, cj = cid
+        cells = set()
+        for key, side in (((cid, 'h'), 0), ((cid, 'v'), 0), (((ci, cj - 1), 'h'), 1), (((ci - 1, cj), 'v'), 1)):
+            for pair in self.borders.get(key, ()): cells.add(pair[side])
+        return cells
+
+    def _local_search(self, source, cid, targets=None):
+        """BFS from source that never leaves the cluster. Returns (distances, parents)."""
+        r0, r1, c0, c1 = self._bounds(cid)
+        grid = self.grid
+        dist = {source: 0}; parent = {source: None}
+        frontier = [source]; remaining = len(targets) if targets else -1
+        while frontier and remaining != 0:
+            nxt = []
+            for r, c in frontier:
+                d = dist[(r, c)] + 1
+                for dr, dc in NEIGHBOURS:
+                    nr, nc = r + dr, c + dc
+                    if r0 <= nr < r1 and c0 <= nc < c1 and grid[nr][nc] == 0 and (nr, nc) not in dist:
+                        dist[(nr, nc)] = d; parent[(nr, nc)] = (r, c); nxt.append((nr, nc))
+                        if targets and (nr, nc) in targets: remaining -= 1
+            frontier = nxt
+        return dist, parent
+
+    def _link_cluster(self, cid):
+        entrances = self._entrances(cid)
+        links = {}
+        for e in entrances:
+            dist, _ = self._local_search(e, cid, entrances)
+            links[e] = {o: dist[o] for o in entrances if o != e and o in dist}
+        self.intra[cid] = links
+
+    # 2. Local updates
+    def invalidate(self, r, c):
+        """Marks the chunk holding a changed cell (and any chunk sharing that border) for a lazy rebuild."""
+        ci, cj = self.cluster_of((r, c))
+        self.dirty.add((ci, cj))
+        if r % self.size == 0 and ci > 0: self.dirty.add((ci - 1, cj))
+        if r % self.size == self.size - 1 and ci + 1 < self.cluster_rows: self.dirty.add((ci + 1, cj))
+        if c % self.size == 0 and cj > 0: self.dirty.add((ci, cj - 1))
+        if c % self.size == self.size - 1 and cj + 1 < self.cluster_cols: self.dirty.add((ci, cj + 1))
+
+    def _refresh(self):
+        if not self.dirty: return
+        relink = set()
+        for ci, cj in self.dirty:
+            for key in (((ci, cj), 'h'), ((ci, cj), 'v'), ((ci, cj - 1), 'h'), ((ci - 1, cj), 'v')):
+                if key[0][0] < 0 or key[0][1] < 0: continue
+                self._drop_border(*key); self._scan_border(*key)
+            relink.update([(ci, cj), (ci, cj - 1), (ci, cj + 1), (ci - 1, cj), (ci + 1, cj)])
+        for cid in relink:
+            if 0 <= cid[0] < self.cluster_rows and 0 <= cid[1] < self.cluster_cols: self._link_cluster(cid)
+        self.dirty.clear()
+        self.segments.clear()
+
+    # 3. Queries
+    @staticmethod
+    def _trace(parent, cell):
+        path = []
+        while cell is not None: path.append(cell); cell = parent[cell]
+        return path[::-1]
+
+    def find_path(self, start, goal):
+        """Near-optimal path as a list of cells from start to goal inclusive, or [] if there is none."""
+        start, goal = tuple(start), tuple(goal)
+        if self.grid[goal[0]][goal[1]] != 0: return []
+        if start == goal: return [start]
+        self._refresh()
+        s_cid, g_cid = self.cluster_of(start), self.cluster_of(goal)
+
+        # Both ends in one chunk: a local search usually settles it
+        if s_cid == g_cid:
+            _, parent = self._local_search(start, s_cid, {goal})
+            if goal in parent: return self._trace(parent, goal)
+
+        # Hook start and goal onto their chunk's entrances
+        s_entrances, g_entrances = self._entrances(s_cid), self._entrances(g_cid)
+        s_dist, s_parent = self._local_search(start, s_cid, s_entrances)
+        g_dist, g_parent = self._local_search(goal, g_cid, g_entrances)
+        exits = {e: g_dist[e] for e in g_entrances if e in g_dist}
+
+        gr, gc = goal
+        heap = []; g_score = {}; came_from = {}
+        for e in s_entrances:
+            if e in s_dist:
+                g_score[e] = s_dist[e]; came_from[e] = None
+                heapq.heappush(heap, (s_dist[e] + abs(e[0] - gr) + abs(e[1] - gc), s_dist[e], e))
+        best = float('inf'); best_node = None; closed = set()
+        while heap:
+            f, g, node = heapq.heappop(heap)
+            if f >= best: break
+            if node in closed: continue
+            closed.add(node)
+            self.expansions += 1
+            if node in exits and g + exits[node] < best: best = g + exits[node]; best_node = node
+            neighbours = list(self.intra.get(self.cluster_of(node), {}).get(node, {}).items())
+            neighbours.extend((other, 1) for other in self.inter.get(node, ()))
+            for other, cost in neighbours:
+                ng = g + cost
+                if ng < g_score.get(other, float('inf')):
+                    g_score[other] = ng; came_from[other] = node
+                    heapq.heappush(heap, (ng + abs(other[0] - gr) + abs(other[1] - gc), ng, other))
+        if best_node is None: return []
+
+        # Refine: walk each abstract hop back down to cells
+        hops = [best_node]
+        while came_from[hops[-1]] is not None: hops.append(came_from[hops[-1]])
+        hops.reverse()
+        path = self._trace(s_parent, hops[0])
+        segments = self.segments
+        for a, b in zip(hops, hops[1:]):
+            if b in self.inter.get(a, ()): path.append(b); continue
+            cells = segments.get((a, b))
+            if cells is None:
+                _, parent = self._local_search(a, self.cluster_of(a), {b})
+                cells = segments[(a, b)] = self._trace(parent, b)[1:]
+                if len(segments) > self.segment_cache_size: segments.popitem(last=False)
+            else: segments.move_to_end((a, b))
+            path.extend(cells)
+        path.extend(self._trace(g_parent, best_node)[::-1][1:])
+        return path
+
+
+class DistanceField:
+    """Walking distance to the nearest of several source cells, from one multi-source BFS.
+
+    Cells are kept in BFS order, so "farthest cell" and "every cell at least k steps away" are slices."""
+    def __init__(self, grid, sources):
+        self.grid = grid
+        self.rows, self.cols = rows, cols = len(grid), len(grid[0])
+        dist = [-1] * (rows * cols)
+        frontier = []
+        for r, c in sources:
+            if 0 <= r < rows and 0 <= c < cols and grid[r][c] == 0 and dist[r * cols + c] < 0:
+                dist[r * cols + c] = 0; frontier.append(r * cols + c)
+        order = []; level_starts = []
+        d = 0
+        while frontier:
+            level_starts.append(len(order)); order.extend(frontier)
+            d += 1; nxt = []
+            for i in frontier:
+                r, c = divmod(i, cols)
+                for j, ok in ((i - cols, r > 0), (i + cols, r < rows - 1), (i - 1, c > 0), (i + 1, c < cols - 1)):
+                    if ok and dist[j] < 0 and grid[j // cols][j % cols] == 0:
+                        dist[j] = d; nxt.append(j)
+            frontier = nxt
+        self._dist = dist
+        self.order = order
+        self.level_starts = level_starts
+
+    def distance(self, cell):
+        """Steps to the nearest source, or None if no source can reach the cell."""
+        d = self._dist[cell[0] * self.cols + cell[1]]
+        return d if d >= 0 else None
+
+    @property
+    def max_distance(self):
+        return len(self.level_starts) - 1
+
+    def cells_at_least(self, k):
+        if k > self.max_distance: return []
+        return [divmod(i, self.cols) for i in self.order[self.level_starts[max(0, k)]:]]
+
+    def farthest(self, rng=random):
+        """A random cell among those farthest from every source, or None if there were no sources."""
+        if not self.order: return None
+        return divmod(rng.choice(self.order[self.level_starts[-1]:]), self.cols)
+
+
+class FieldCache:
+    """DistanceFields shared between games played on the same grid, least recently used dropped first."""
+    def __init__(self, max_fields=512):
+        self.max_fields = max_fields
+        self.fields = OrderedDict() # (grid id, grid version, sources) -> DistanceField
+        self.hits = self.misses = 0
+
+    def get(self, grid, version, sources):
+        key = (id(grid), version, tuple(sources))
+        field = self.fields.get(key)
+        if field is not None and field.grid is grid: # The field pins its grid, but ids of dead grids get reused
+            self.fields.move_to_end(key); self.hits += 1
+            return field
+        self.misses += 1
+        field = self.fields[key] = DistanceField(grid, sources)
+        self.fields.move_to_end(key)
+        while len(self.fields) > self.max_fields: self.fields.popitem(last=False)
+        return field
+
+
+class ReservationTable:
+    """Space-time reservations for cooperative pathfinding: who holds which cell over which frames."""
+    def __init__(self):
+        self.cells = {}    # cell -> [(first frame, end frame exclusive, agent)]
+        self.by_agent = {} # agent -> [cell]
+
+    def reserve(self, agent, cell, start, end):
+        self.cells.setdefault(cell, []).append((start, end, agent))
+        self.by_agent.setdefault(agent, []).append(cell)
+
+    def release(self, agent):
+        for cell in self.by_agent.pop(agent, ()):
+            slots = self.cells.get(cell)
+            if slots is None: continue
+            slots[:] = [s for s in slots if s[2] != agent]
+            if not slots: del self.cells[cell]
+
+    def is_free(self, cell, start, end, agent):
+        for s, e, other in self.cells.get(cell, ()):
+            if other != agent and s < end and start < e: return False
+        return True
+
+    def prune(self, now):
+        """Forgets reservations that ended before `now`."""
+        for cell in list(self.cells):
+            slots = [s for s in self.cells[cell] if s[1] > now]
+            if slots: self.cells[cell] = slots
+            else: del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear(); self.by_agent.clear()
+
+    def copy(self):
+        twin = ReservationTable()
+        twin.cells = {cell: list(slots) for cell, slots in self.cells.items()}
+        twin.by_agent = {agent: list(cells) for agent, cells in self.by_agent.items()}
+        return twin
+
+
+def cooperative_search(grid, start, field, t0, step, window, table, agent, max_expansions=500):
+    """Windowed space-time A* (WHCA*). Plans up to `window` moves, one every `step` frames from frame t0,
+    around other agents' reservations. `field` is the true distance to the target (the abstract heuristic).
+
+    Returns (cells, expansions); cells holds one entry per move (waiting repeats the cell), or None if boxed in."""
+    rows, cols = len(grid), len(grid[0])
+    h0 = field.distance(start)
+    if h0 is None: return None, 0
+    start = tuple(start)
+    heap = [(h0, 0, start)]
+    parent = {(start, 0): None}
+    expansions = 0; end = None; best = None
+    while heap and expansions < max_expansions:
+        f, neg_k, cell = heapq.heappop(heap)
+        k = -neg_k; h = f - k
+        expansions += 1
+        if best is None or (h, -k) < best[0]: best = ((h, -k), (cell, k))
+        if k == window or h == 0: end = (cell, k); break
+        t = t0 + k * step
+        r, c = cell
+        for nxt in (cell, (r, c + 1), (r, c - 1), (r + 1, c), (r - 1, c)):
+            nr, nc = nxt
+            if not (0 <= nr < rows and 0 <= nc < cols) or grid[nr][nc] != 0 or (nxt, k + 1) in parent: continue
+            if not table.is_free(nxt, t, t + step, agent): continue
+            nh = field.distance(nxt)
+            if nh is None: continue
+            parent[(nxt, k + 1)] = (cell, k)
+            heapq.heappush(heap, (k + 1 + nh, -(k + 1), nxt))
+    if end is None:
+        if best is None or best[1][1] == 0: return None, expansions
+        end = best[1] # Out of budget: settle for the state that got closest
+    cells = []
+    state = end
+    while state[1] > 0: cells.append(state[0]); state = parent[state]
+    return cells[::-1], expansions
+
+
+# --- VISIBILITY ---
+# Symmetric shadowcasting (the variant that guarantees a sees b exactly when b sees a) scans the four
+# quadrants row by row. Slopes are kept as integer (numerator, denominator) pairs so no float rounding
+# ever lets a ray slip through a wall corner. Row `depth`, column `col` of a quadrant is
+# (r0 + depth*dr + col*cr, c0 + depth*dc + col*cc).
+_QUADRANTS = ((-1, 0, 0, 1), (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0))
+
+def field_of_view(grid, origin, radius):
+    """Cells in line of sight of `origin` within `radius` (walls that face it included), as a frozenset."""
+    rows, cols = len(grid), len(grid[0])
+    r0, c0 = origin
+    visible = {(r0, c0)}
+    reach = radius * radius
+    for dr, dc, cr, cc in _QUADRANTS:
+        scans = [(1, -1, 1, 1, 1)] # depth, start slope, end slope
+        while scans:
+            depth, s_num, s_den, e_num, e_den = scans.pop()
+            if depth > radius: continue
+            lo = (2 * depth * s_num + s_den) // (2 * s_den)     # round half up
+            hi = -((e_den - 2 * depth * e_num) // (2 * e_den)) # round half down
+            prev_wall = None
+            for col in range(lo, hi + 1):
+                r = r0 + depth * dr + col * cr; c = c0 + depth * dc + col * cc
+                inside = 0 <= r < rows and 0 <= c < cols
+                wall = not inside or grid[r][c] != 0
+                if inside and depth * depth + col * col <= reach and (wall or (col * s_den >= depth * s_num and col * e_den <= depth * e_num)):
+                    visible.add((r, c))
+                if prev_wall and not wall: s_num, s_den = 2 * col - 1, 2 * depth
+                if prev_wall is False and wall: scans.append((depth + 1, s_num, s_den, 2 * col - 1, 2 * depth))
+                prev_wall = wall
+            if prev_wall is False: scans.append((depth + 1, s_num, s_den, e_num, e_den))
+    return frozenset(visible)
+
+class VisibilityCache:
+    """field_of_view per origin cell for one grid, least recently used dropped first. Standing still or
+    pacing a corridor reuses the sets, and by symmetry the player's set also answers every "can X see the
+    player" question without casting from X."""
+    def __init__(self, radius, max_cells=4096):
+        self.radius = radius
+        self.max_cells = max_cells
+        self.cells = OrderedDict() # origin -> frozenset
+        self.grid = None
+        self.version = None
+        self.hits = self.misses = 0
+
+    def invalidate(self):
+        self.cells.clear()
+
+    def get(self, grid, version, origin):
+        if grid is not self.grid or version != self.version: self.cells.clear(); self.grid = grid; self.version = version
+        seen = self.cells.get(origin)
+        if seen is not None:
+            self.cells.move_to_end(origin); self.hits += 1
+            return seen
+        self.misses += 1
+        seen = self.cells[origin] = field_of_view(grid, origin, self.radius)
+        while len(self.cells) > self.max_cells: self.cells.popitem(last=False)
+        return seen
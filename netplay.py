@@ -0,0 +1,382 @@
+"""Two-player VS over the network. The server runs the only real GameState and streams delta-compressed
+state to both players at a fixed tick; clients predict their own moves so the controls feel local.
+
+    python netplay.py server [--host 0.0.0.0] [--port 5555]
+    python netplay.py client [--host HOST] [--port 5555] [--window]
+    python netplay.py bench  [--seconds 10] [--lag 80]
+
+Player one is the usual player, player two steers the piglin. Messages are JSON lines: a client sends
+{"seq", "bits"} once per tick; the server sends a "hello" at the start of every round, then one update
+per tick holding only what changed since the last update that client was sent, plus the last input
+sequence number it has applied ("ack") so the client can replay the inputs still in flight."""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+
+if "--window" not in sys.argv: os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import game
+from game import GameState, FPS, INPUT_LEFT, INPUT_RIGHT, INPUT_UP, INPUT_DOWN
+
+PORT = 5555
+ARROWS = INPUT_LEFT | INPUT_RIGHT | INPUT_UP | INPUT_DOWN
+ROUND_BREAK = 3 * FPS       # Ticks between a game ending and the next round's hello
+MAX_BACKLOG = 3             # Inputs a seat may queue before the oldest are dropped (latency beats lockstep)
+MAX_WRITE_BUFFER = 64 * 1024 # A client this far behind gets no update; the next delta covers the gap
+
+def input_direction(bits):
+    """(dr, dc) with the same priority as GameState.step."""
+    if bits & INPUT_LEFT: return 0, -1
+    if bits & INPUT_RIGHT: return 0, 1
+    if bits & INPUT_UP: return -1, 0
+    if bits & INPUT_DOWN: return 1, 0
+    return 0, 0
+
+# --- STATE SYNC ---
+def world_view(state):
+    """Everything a client needs to draw the round, as JSON-friendly values. Index 0 is player one."""
+    bot = state.bots[0]
+    return {'p': [list(state.player_pos), list(bot['pos'])], 's': [state.user_score, bot['score']],
+            'mt': [state.move_timer, bot['move_timer']], 'md': [state.move_delay, bot['speed']],
+            'key': state.key_pos and list(state.key_pos), 'heart': state.heart_pos and list(state.heart_pos),
+            'hk': state.has_key, 'sh': state.has_shield, 'wt': state.warmup_timer, 'wu': state.is_warming_up,
+            'on': state.game_active, 'won': state.game_won, 'msg': state.game_over_text,
+            'rw': {"%d,%d" % rew['pos']: [rew['type'], rew['val']] for rew in state.rewards}}
+
+def view_delta(old, new):
+    """Fields of `new` that differ from `old`. Rewards travel as added and removed cells."""
+    delta = {k: v for k, v in new.items() if k != 'rw' and (k not in old or old[k] != v)}
+    old_rewards = old.get('rw', {})
+    added = {cell: rew for cell, rew in new['rw'].items() if old_rewards.get(cell) != rew}
+    removed = [cell for cell in old_rewards if cell not in new['rw']]
+    if added: delta['rw+'] = added
+    if removed: delta['rw-'] = removed
+    return delta
+
+def apply_view_delta(view, delta):
+    for k, v in delta.items():
+        if k == 'rw+': view.setdefault('rw', {}).update(v)
+        elif k == 'rw-':
+            for cell in v: view['rw'].pop(cell, None)
+        else: view[k] = v
+
+def encode(message):
+    return (json.dumps(message, separators=(',', ':')) + "\n").encode()
+
+# --- SERVER ---
+class Seat:
+    """One connected player on the server side."""
+    def __init__(self, index, writer):
+        self.index = index
+        self.writer = writer
+        self.inputs = deque() # (seq, bits) in arrival order
+        self.held = 0         # Reused on ticks where no input arrived
+        self.ack = 0
+        self.sent = {}        # The view this client was last sent, the base of its next delta
+        self.bytes_out = 0
+
+    def next_bits(self):
+        while len(self.inputs) > MAX_BACKLOG: self.ack = self.inputs.popleft()[0]
+        if self.inputs: self.ack, self.held = self.inputs.popleft()
+        return self.held
+
+    def send(self, message):
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER: return 0
+        line = encode(message)
+        self.writer.write(line); self.bytes_out += len(line)
+        return len(line)
+
+class NetServer:
+    """THE REFEREE: Owns the authoritative GameState and steps it at a fixed tick once both seats are taken."""
+    def __init__(self, seed=None, rows=25, tick_rate=FPS):
+        self.rng = random.Random(seed)
+        self.rows = rows
+        self.tick_rate = tick_rate
+        self.seats = [None, None]
+        self.state = None
+        self.round = 0
+        self.tick = 0
+        self.stats = {'updates': 0, 'delta_bytes': 0, 'full_bytes': 0, 'late_ticks': 0, 'worst_late_ms': 0.0}
+
+    async def start(self, host="127.0.0.1", port=PORT):
+        self.server = await asyncio.start_server(self._connected, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def close(self):
+        for seat in self.seats:
+            if seat: seat.writer.close()
+        self.server.close()
+
+    async def _connected(self, reader, writer):
+        if None not in self.seats: writer.close(); return
+        index = self.seats.index(None)
+        seat = self.seats[index] = Seat(index, writer)
+        if self.state: self._hello(seat)
+        try:
+            async for line in reader:
+                msg = json.loads(line)
+                seat.inputs.append((int(msg['seq']), int(msg['bits']) & ARROWS))
+        except (ConnectionError, ValueError, KeyError): pass
+        finally:
+            if self.seats[index] is seat: self.seats[index] = None
+            writer.close()
+
+    def _new_round(self):
+        self.round += 1
+        self.state = GameState(self.rows, "vs_ai", seed=self.rng.randrange(2**63), opponent="remote")
+        for seat in self.seats: self._hello(seat)
+
+    def _hello(self, seat):
+        state = self.state
+        seat.sent = {}
+        seat.send({'hello': self.round, 'you': seat.index, 'seed': state.seed, 'rows': state.rows, 'cols': state.cols,
+                   'generator': state.maze_generator.name, 'tick_rate': self.tick_rate})
+
+    def _broadcast(self):
+        view = world_view(self.state)
+        full = len(encode(view))
+        for seat in self.seats:
+            delta = view_delta(seat.sent, view)
+            delta['t'] = self.tick; delta['ack'] = seat.ack
+            size = seat.send(delta)
+            if size: seat.sent = view; self.stats['updates'] += 1; self.stats['delta_bytes'] += size; self.stats['full_bytes'] += full
+
+    async def run(self, ticks=None):
+        """Plays `ticks` ticks (forever by default), pausing while a seat is empty."""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        over = 0
+        while ticks is None or self.tick < ticks:
+            if all(self.seats):
+                if self.state is None or over >= ROUND_BREAK: self._new_round(); over = 0
+                bits = [seat.next_bits() for seat in self.seats]
+                self.state.step(bits[0], bits[1])
+                if not self.state.game_active: over += 1
+                self._broadcast()
+                self.tick += 1
+            next_tick += 1 / self.tick_rate
+            late = loop.time() - next_tick
+            if late > 0:
+                self.stats['late_ticks'] += 1; self.stats['worst_late_ms'] = max(self.stats['worst_late_ms'], late * 1000)
+                next_tick = loop.time() # Don't try to catch up with a burst of ticks
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+
+# --- CLIENT ---
+def chase_rewards(client):
+    """Headless stand-in for a human: walks to the nearest reward, or to the portal once it can win there."""
+    view, pos = client.view, tuple(client.predicted)
+    plan = client.plan
+    while plan and plan[0] == pos: plan.pop(0)
+    if not plan or abs(plan[0][0] - pos[0]) + abs(plan[0][1] - pos[1]) != 1 or client.seq % FPS == 0:
+        score = view['s'][client.you]
+        can_win = score > 0 and (client.you == 1 or view['hk'])
+        targets = [tuple(map(int, cell.split(','))) for cell in view['rw']]
+        if client.you == 0 and view['key']: targets.append(tuple(view['key']))
+        if can_win or not targets: targets = [tuple(client.mirror.goal_pos)]
+        target = min(targets, key=lambda t: abs(t[0] - pos[0]) + abs(t[1] - pos[1]))
+        client.plan = plan = [tuple(cell) for cell in client.mirror.get_astar_path(pos, target)[1:]]
+    if not plan: return 0
+    dr, dc = plan[0][0] - pos[0], plan[0][1] - pos[1]
+    return INPUT_DOWN if dr > 0 else INPUT_UP if dr < 0 else INPUT_RIGHT if dc > 0 else INPUT_LEFT
+
+class NetClient:
+    """THE REMOTE: Sends one input per tick, mirrors the server's view of the round and predicts its own
+    avatar: every input moves it locally at once, and each server update resets it to the authoritative
+    position and replays the inputs the server hasn't applied yet."""
+    def __init__(self, policy=chase_rewards, lag=0.0):
+        self.policy = policy
+        self.lag = lag # Extra round trip, added on the way up
+        self.view = {}
+        self.you = None
+        self.round = None
+        self.mirror = None # A GameState built from the round's seed: same maze, drawn from the view
+        self.tick_rate = FPS
+        self.seq = 0
+        self.pending = deque() # (seq, bits) the server hasn't acked
+        self.sent_at = {}
+        self.predicted_at = {}
+        self.predicted = None
+        self.timer = 0
+        self.plan = []
+        self.connected = False
+        self.latencies = []
+        self.checked = self.mispredicted = 0
+        self.bytes_in = self.bytes_out = self.updates = 0
+
+    async def connect(self, host="127.0.0.1", port=PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.connected = True
+        self.listener = asyncio.create_task(self._listen())
+
+    def close(self):
+        self.writer.close()
+
+    async def _listen(self):
+        try:
+            async for line in self.reader:
+                self.bytes_in += len(line)
+                self._receive(json.loads(line))
+        except ConnectionError: pass
+        self.connected = False
+
+    def _receive(self, msg):
+        if 'hello' in msg:
+            self.you, self.round, self.tick_rate = msg['you'], msg['hello'], msg['tick_rate']
+            self.mirror = GameState(msg['rows'], "vs_ai", cols=msg['cols'], generator=msg['generator'], seed=msg['seed'], opponent="remote")
+            self.view = {}; self.predicted = None; self.plan = []
+            self.pending.clear(); self.sent_at.clear(); self.predicted_at.clear()
+            return
+        apply_view_delta(self.view, msg)
+        self.updates += 1
+        ack = msg['ack']
+        server_pos = tuple(self.view['p'][self.you])
+        if ack in self.predicted_at:
+            self.checked += 1; self.mispredicted += self.predicted_at[ack] != server_pos
+        now = time.perf_counter()
+        while self.pending and self.pending[0][0] <= ack:
+            seq, _ = self.pending.popleft()
+            self.latencies.append(now - self.sent_at.pop(seq))
+            self.predicted_at.pop(seq, None)
+        # Reconcile: start from the server's word and replay what it hasn't seen
+        pos, timer = list(server_pos), self.view['mt'][self.you]
+        for _, bits in self.pending: pos, timer = self._predict(pos, timer, bits)
+        self.predicted, self.timer = pos, timer
+
+    def _predict(self, pos, timer, bits):
+        """One tick of the local avatar, with the same timer rules the server's step() applies."""
+        if not self.view['on']: return pos, timer
+        if timer > 0: return pos, timer - 1
+        dr, dc = input_direction(bits)
+        if dr == 0 and dc == 0: return pos, timer
+        timer = self.view['md'][self.you]
+        if self.view['wu']: return pos, timer
+        nr, nc = pos[0] + dr, pos[1] + dc
+        grid = self.mirror.grid
+        if 0 <= nr < len(grid) and 0 <= nc < len(grid[0]) and grid[nr][nc] == 0: pos = [nr, nc]
+        return pos, timer
+
+    def tick(self):
+        """Samples the policy, moves the local avatar and sends the input."""
+        if self.mirror is None or 'p' not in self.view: return
+        if self.predicted is None: self.predicted, self.timer = list(self.view['p'][self.you]), self.view['mt'][self.you]
+        bits = self.policy(self) & ARROWS
+        self.seq += 1
+        self.pending.append((self.seq, bits)); self.sent_at[self.seq] = time.perf_counter()
+        self.predicted, self.timer = self._predict(self.predicted, self.timer, bits)
+        self.predicted_at[self.seq] = tuple(self.predicted)
+        line = encode({'seq': self.seq, 'bits': bits})
+        self.bytes_out += len(line)
+        if self.lag: asyncio.get_running_loop().call_later(self.lag, self._write, line)
+        else: self._write(line)
+
+    def _write(self, line):
+        if not self.writer.is_closing(): self.writer.write(line)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while self.connected:
+            self.tick()
+            next_tick = max(next_tick + 1 / self.tick_rate, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
+
+    def sync_mirror(self):
+        """Copies the latest view, with the predicted local avatar, into the mirror GameState for drawing."""
+        m, v = self.mirror, self.view
+        players = [list(p) for p in v['p']]
+        if self.predicted is not None: players[self.you] = list(self.predicted)
+        m.player_pos, m.bots[0]['pos'] = players
+        m.user_score, m.bots[0]['score'] = v['s']
+        m.rewards = [{'pos': tuple(map(int, cell.split(','))), 'type': t, 'color': game.reward_color(t, val), 'val': val} for cell, (t, val) in v['rw'].items()]
+        m.key_pos = v['key'] and tuple(v['key']); m.key_spawned = m.key_spawned or v['key'] is not None
+        m.heart_pos = v['heart'] and tuple(v['heart']); m.heart_spawned = m.heart_spawned or v['heart'] is not None
+        m.has_key, m.has_shield = v['hk'], v['sh']
+        m.warmup_timer, m.is_warming_up = v['wt'], v['wu']
+        m.game_active, m.game_won, m.game_over_text = v['on'], v['won'], v['msg']
+
+async def play_window(client):
+    renderer = game.GameRenderer(game.screen)
+    drawn_round = None
+    while client.connected:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE): return
+        if client.mirror and 'p' in client.view:
+            if drawn_round != client.round: renderer.init_level(client.mirror); drawn_round = client.round
+            client.sync_mirror()
+            renderer.draw_game(client.mirror)
+            game.present()
+        await asyncio.sleep(1 / FPS)
+
+# --- ENTRY POINTS ---
+async def serve(args):
+    server = NetServer(args.seed, args.rows, args.tick_rate)
+    port = await server.start(args.host, args.port)
+    print(f"VS server on {args.host}:{port}, waiting for two players")
+    await server.run()
+
+async def connect(args):
+    policy = (lambda client: game.held_input_bits(pygame.key.get_pressed())) if args.window else chase_rewards
+    client = NetClient(policy, args.lag / 1000)
+    await client.connect(args.host, args.port)
+    ticking = asyncio.create_task(client.run())
+    if args.window: await play_window(client); client.close()
+    await ticking
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+async def bench(args):
+    server = NetServer(args.seed, args.rows, args.tick_rate)
+    port = await server.start("127.0.0.1", 0)
+    clients = [NetClient(lag=args.lag / 1000) for _ in range(2)]
+    for client in clients: await client.connect("127.0.0.1", port)
+    runs = [asyncio.create_task(client.run()) for client in clients]
+    t0 = time.perf_counter()
+    await server.run(int(args.seconds * args.tick_rate))
+    elapsed = time.perf_counter() - t0
+    server.close()
+    await asyncio.gather(*runs)
+
+    stats = server.stats
+    print(f"{server.tick} ticks in {elapsed:.1f}s over {server.round} round(s), {stats['late_ticks']} late (worst {stats['worst_late_ms']:.1f} ms)")
+    print(f"update size: {stats['delta_bytes'] / max(1, stats['updates']):.0f} B as deltas, {stats['full_bytes'] / max(1, stats['updates']):.0f} B as full views "
+          f"({stats['full_bytes'] / max(1, stats['delta_bytes']):.1f}x saved)")
+    print(f"{'player':<7} {'down KB/s':>10} {'up KB/s':>8} {'updates/s':>10} {'rtt mean ms':>12} {'rtt p95 ms':>11} {'mispredicted':>13}")
+    for client in clients:
+        lat = client.latencies
+        print(f"{client.you + 1:<7} {client.bytes_in / 1024 / elapsed:>10.2f} {client.bytes_out / 1024 / elapsed:>8.2f} {client.updates / elapsed:>10.1f} "
+              f"{1000 * sum(lat) / max(1, len(lat)):>12.1f} {1000 * percentile(lat, 0.95):>11.1f} {client.mispredicted:>6}/{client.checked:<6}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    server_p = sub.add_parser("server", help="host a VS game")
+    server_p.add_argument("--host", default="0.0.0.0")
+    server_p.add_argument("--port", type=int, default=PORT)
+    client_p = sub.add_parser("client", help="join a VS game (headless unless --window)")
+    client_p.add_argument("--host", default="127.0.0.1")
+    client_p.add_argument("--port", type=int, default=PORT)
+    client_p.add_argument("--window", action="store_true", help="play with the keyboard instead of the headless policy")
+    client_p.add_argument("--lag", type=float, default=0, help="extra round trip in ms, to try the prediction")
+    bench_p = sub.add_parser("bench", help="server and two headless clients on localhost: bandwidth, latency, prediction")
+    bench_p.add_argument("--seconds", type=float, default=10)
+    bench_p.add_argument("--lag", type=float, default=0, help="extra round trip in ms")
+    for p in (server_p, bench_p):
+        p.add_argument("--rows", type=int, default=25)
+        p.add_argument("--tick-rate", type=int, default=FPS)
+        p.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args()
+    asyncio.run({"server": serve, "client": connect, "bench": bench}[args.command](args))
+
+if __name__ == "__main__":
+    main()
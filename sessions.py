@@ -0,0 +1,183 @@
+"""Hosts many GameStates in one process on a shared fixed tick, for bot tournaments and load tests.
+
+    python sessions.py bench [--mode hell] [--seeds 4] [--seconds 3]
+
+Sessions started from the same seed, size and mode are clones of one pristine template, so they share
+the grid and the corridor graph, and every session's distance fields go through one FieldCache. The
+bench doubles the session count until the host can no longer keep every session on the tick, which
+is how many concurrent games one core sustains."""
+import argparse
+import os
+import random
+import time
+from collections import deque
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from game import GameState, FPS, INPUT_LEFT, INPUT_RIGHT, INPUT_UP, INPUT_DOWN
+from maze import FieldCache
+
+ARROWS = (INPUT_LEFT, INPUT_RIGHT, INPUT_UP, INPUT_DOWN)
+
+class RandomWalk:
+    """A stand-in player: holds a random arrow for a few frames at a time."""
+    def __init__(self, seed, hold=6):
+        self.rng = random.Random(seed)
+        self.hold = hold
+        self.bits = 0
+        self.frames = 0
+
+    def __call__(self, state):
+        if self.frames % self.hold == 0: self.bits = self.rng.choice(ARROWS)
+        self.frames += 1
+        return self.bits
+
+class Session:
+    """One hosted game with its own tick accounts."""
+    def __init__(self, sid, key, state, policy):
+        self.id = sid
+        self.key = key          # Template it was cloned from: (seed, rows, cols, mode, generator)
+        self.state = state
+        self.policy = policy
+        self.due = 0            # Host ticks since the session joined
+        self.ran = 0            # Steps actually run
+        self.busy = 0.0         # Seconds spent stepping it
+        self.worst = 0.0
+        self.games = 0          # Finished games (a finished game restarts from its template)
+
+    @property
+    def lag(self):
+        return self.due - self.ran
+
+class SessionHost:
+    """THE ARENA: Steps every session once per tick. When a tick's budget runs out the sessions left over
+    wait, and the next tick starts with whoever is furthest behind; spare time in a tick goes to catching
+    the laggards up, so no session starves while others run ahead."""
+    def __init__(self, tick_rate=FPS, share=True, max_fields=1024, max_catch_up=2, skip_countdown=False):
+        self.tick_rate = tick_rate
+        self.skip_countdown = skip_countdown
+        self.budget = 1 / tick_rate
+        self.share = share
+        self.max_catch_up = max_catch_up
+        self.field_cache = FieldCache(max_fields) if share else None
+        self.templates = {} # key -> pristine GameState
+        self.sessions = {}
+        self.next_id = 0
+        self.tick = 0
+        self.overruns = 0   # Ticks that ran out of budget
+        self.busy = 0.0
+        self.step_times = deque(maxlen=8192)
+
+    def _fresh_state(self, key):
+        seed, rows, cols, mode, generator = key
+        if not self.share: state = GameState(rows, mode, cols=cols, generator=generator, seed=seed)
+        else:
+            template = self.templates.get(key)
+            if template is None:
+                template = self.templates[key] = GameState(rows, mode, cols=cols, generator=generator, seed=seed)
+                template.field_cache = self.field_cache
+                template.corridor_graph() # Built once here, so every clone shares it
+            state = template.clone()
+        if self.skip_countdown: state.warmup_timer = 1
+        return state
+
+    def add(self, seed, rows=25, mode="hell", policy=None, cols=None, generator="backtracker"):
+        key = (seed, rows, cols, mode, generator)
+        sid = self.next_id; self.next_id += 1
+        self.sessions[sid] = Session(sid, key, self._fresh_state(key), policy or RandomWalk(seed + sid))
+        return sid
+
+    def remove(self, sid):
+        return self.sessions.pop(sid)
+
+    def _step(self, session):
+        t0 = time.perf_counter()
+        state = session.state
+        state.step(session.policy(state))
+        if not state.game_active: session.games += 1; session.state = self._fresh_state(session.key)
+        elapsed = time.perf_counter() - t0
+        session.ran += 1; session.busy += elapsed; session.worst = max(session.worst, elapsed)
+        self.step_times.append(elapsed)
+
+    def run_tick(self):
+        """One host tick. Returns the seconds it took."""
+        start = time.perf_counter(); deadline = start + self.budget
+        for session in self.sessions.values(): session.due += 1
+        queue = sorted(self.sessions.values(), key=lambda s: -s.lag)
+        for session in queue:
+            if time.perf_counter() >= deadline: self.overruns += 1; break
+            self._step(session)
+        for _ in range(self.max_catch_up): # Spare time: catch up whoever is behind, most behind first
+            behind = [s for s in queue if s.lag > 0]
+            if not behind: break
+            for session in behind:
+                if time.perf_counter() >= deadline: break
+                self._step(session)
+        self.tick += 1
+        elapsed = time.perf_counter() - start
+        self.busy += elapsed
+        return elapsed
+
+    def run(self, seconds):
+        """Real-time: one tick every 1/tick_rate seconds, sleeping off whatever budget is left."""
+        next_tick = time.perf_counter()
+        end = next_tick + seconds
+        while next_tick < end:
+            self.run_tick()
+            next_tick += self.budget
+            pause = next_tick - time.perf_counter()
+            if pause > 0: time.sleep(pause)
+            else: next_tick = time.perf_counter()
+
+    def metrics(self):
+        sessions = list(self.sessions.values())
+        steps = sorted(self.step_times)
+        cache = self.field_cache
+        return {
+            'sessions': len(sessions),
+            'ticks': self.tick,
+            'overruns': self.overruns,
+            'utilisation': self.busy / max(1e-9, self.tick * self.budget),
+            'steps': sum(s.ran for s in sessions),
+            'games': sum(s.games for s in sessions),
+            'max_lag': max((s.lag for s in sessions), default=0),
+            'mean_lag': sum(s.lag for s in sessions) / max(1, len(sessions)),
+            'step_p50_us': steps[len(steps) // 2] * 1e6 if steps else 0.0,
+            'step_p95_us': steps[int(len(steps) * 0.95)] * 1e6 if steps else 0.0,
+            'templates': len(self.templates),
+            'field_hit_rate': cache.hits / max(1, cache.hits + cache.misses) if cache else 0.0,
+        }
+
+def bench(args):
+    print(f"{'sessions':>8} {'util':>6} {'steps/s':>9} {'p50 us':>7} {'p95 us':>7} {'max lag':>8} {'overruns':>9} {'games':>6} {'fields hit':>11}")
+    count = args.start
+    while count <= args.max:
+        host = SessionHost(share=not args.no_share, skip_countdown=True)
+        for i in range(count): host.add(args.seed + i % args.seeds, args.rows, args.mode)
+        host.run(args.seconds)
+        m = host.metrics()
+        print(f"{m['sessions']:>8} {m['utilisation']:>6.0%} {m['steps'] / args.seconds:>9,.0f} {m['step_p50_us']:>7.0f} {m['step_p95_us']:>7.0f} "
+              f"{m['max_lag']:>8} {m['overruns']:>9} {m['games']:>6} {m['field_hit_rate']:>11.0%}")
+        # Sustained means every session stays within a tick or two of real time
+        if m['max_lag'] > 2: print(f"-> one core keeps about {count // 2} {args.mode} sessions on a {FPS} Hz tick"); break
+        count *= 2
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_p = sub.add_parser("bench", help="double the session count until the tick can't keep up")
+    bench_p.add_argument("--mode", default="hell", choices=("solo", "vs_ai", "hell"))
+    bench_p.add_argument("--rows", type=int, default=25)
+    bench_p.add_argument("--seeds", type=int, default=4, help="distinct mazes; sessions beyond this share one")
+    bench_p.add_argument("--seed", type=int, default=1)
+    bench_p.add_argument("--start", type=int, default=8)
+    bench_p.add_argument("--max", type=int, default=4096)
+    bench_p.add_argument("--seconds", type=float, default=3)
+    bench_p.add_argument("--no-share", action="store_true", help="give every session its own maze and caches")
+    bench_p.set_defaults(func=bench)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
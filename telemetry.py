@@ -0,0 +1,210 @@
+"""Opt-in runtime telemetry: periodic health samples as newline-delimited JSON.
+
+    python game.py --telemetry hell.ndjson              (or --telemetry unix:/tmp/maze.sock; add --telemetry-malloc for allocators)
+    python telemetry.py run [--mode hell] [--endless] [--minutes 30] [--out hell.ndjson] [--top 10]
+    python telemetry.py listen /tmp/maze.sock
+
+Each sample holds entity counts, get_astar_path calls and latency, hell bot planning (BotPlanner._plan
+calls, latency and search expansions; hell bots plan cooperatively and only fall back on A*) and frame-time
+percentiles. Allocator tracing is a separate opt-in: with it, samples also carry traced memory, and every few
+of them list the top tracemalloc allocators and how much each grew since the last listing. Tracing hooks every
+allocation and makes frames and planning several times slower, so samples taken while it is on are marked
+"tracemalloc": true and their timings are not latency figures. The game thread only copies counters into a
+dict. Encoding, writing and the allocator statistics happen on a background writer thread, and the queue
+between the two is bounded: when the writer falls behind, samples are dropped (and counted) instead of
+stalling a frame."""
+import argparse
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import tracemalloc
+
+def percentile(values, q):
+    """values must be sorted."""
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+class CallProbe:
+    """Times every call to one method (e.g. GameState.get_astar_path) while installed. Nothing is wrapped
+    when telemetry is off."""
+    def __init__(self, name):
+        self.name = name
+        self.cls = None
+        self.original = None
+        self.calls = 0
+        self.seconds = 0.0
+        self.worst = 0.0
+
+    def install(self, cls):
+        self.cls, self.original = cls, getattr(cls, self.name)
+        original, probe = self.original, self
+        def timed(*args):
+            t0 = time.perf_counter()
+            try: return original(*args)
+            finally:
+                spent = time.perf_counter() - t0
+                probe.calls += 1; probe.seconds += spent
+                if spent > probe.worst: probe.worst = spent
+        setattr(cls, self.name, timed)
+
+    def uninstall(self):
+        if self.cls is not None: setattr(self.cls, self.name, self.original); self.cls = None
+
+    def take(self):
+        """Counts since the last take."""
+        out = {'calls': self.calls, 'ms_total': round(self.seconds * 1e3, 3),
+               'ms_mean': round(self.seconds * 1e3 / self.calls, 4) if self.calls else 0, 'ms_max': round(self.worst * 1e3, 4)}
+        self.calls = 0; self.seconds = 0.0; self.worst = 0.0
+        return out
+
+class Telemetry:
+    """THE FLIGHT RECORDER: Call frame() once per game frame; every `interval` seconds it turns what it saw
+    into one sample and hands it to the writer thread. `target` is a file path (appended to) or unix:PATH."""
+    def __init__(self, target, interval=1.0, queue_size=64, malloc_every=10, malloc_top=0):
+        self.interval = interval
+        self.malloc_every = malloc_every # Allocator listings every this many samples: snapshots aren't free
+        self.malloc_top = malloc_top     # 0 leaves tracemalloc off altogether: tracing slows every allocation
+        self.queue = queue.Queue(queue_size)
+        self.astar = CallProbe("get_astar_path")
+        self.planner = CallProbe("_plan")
+        self.frame_times = []
+        self.expansions = 0
+        self.samples = 0
+        self.dropped = 0
+        self.errors = 0 # Failed writes, e.g. the socket listener went away
+        self.socket = None
+        if target.startswith("unix:"):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); self.socket.connect(target[5:])
+            self.sink = self.socket.makefile("w", encoding="utf-8")
+        else: self.sink = open(target, "a", encoding="utf-8")
+        self.own_tracing = bool(malloc_top) and not tracemalloc.is_tracing()
+        if self.own_tracing: tracemalloc.start()
+        self.started = self.last_sample = time.perf_counter()
+        self.writer = threading.Thread(target=self._write_loop, name="telemetry-writer", daemon=True)
+        self.writer.start()
+
+    def instrument(self, state_cls, planner_cls):
+        """Starts timing GameState.get_astar_path and BotPlanner._plan. Returns self, to chain onto the constructor."""
+        self.astar.install(state_cls); self.planner.install(planner_cls)
+        return self
+
+    def frame(self, state, seconds, **extra):
+        """One frame's work time; `state` is the running game or None (in the menu). `extra` goes into the sample."""
+        self.frame_times.append(seconds)
+        if state is not None: self.expansions += state.bot_planner.expansions
+        now = time.perf_counter()
+        if now - self.last_sample >= self.interval: self.sample(state, now, extra)
+
+    def sample(self, state, now, extra):
+        times = sorted(self.frame_times); self.frame_times = []
+        record = {'t': round(now - self.started, 3), 'seq': self.samples, 'frames': len(times), 'dropped': self.dropped}
+        if times: record['frame_ms'] = {'p50': round(percentile(times, 0.5) * 1e3, 3), 'p90': round(percentile(times, 0.9) * 1e3, 3),
+                                        'p99': round(percentile(times, 0.99) * 1e3, 3), 'max': round(times[-1] * 1e3, 3)}
+        record['astar'] = self.astar.take()
+        record['planner'] = self.planner.take()
+        record['planner_expansions'] = self.expansions; self.expansions = 0
+        if state is not None:
+            record['game'] = {'mode': state.mode, 'endless': state.endless, 'fog': state.fog, 'game_time': state.game_time, 'depth': state.depth}
+            record['entities'] = {'bots': len(state.bots), 'creepers': len(state.creepers), 'bombs': len(state.bombs),
+                                  'fire_charges': len(state.fire_charges), 'ghasts': len(state.ghasts), 'rewards': len(state.rewards),
+                                  'enderman': state.enderman is not None, 'path_taken': len(state.path_taken)}
+        if tracemalloc.is_tracing(): # Ours or someone else's, the timings above paid for it either way
+            record['tracemalloc'] = True
+            current, peak = tracemalloc.get_traced_memory()
+            record['memory_kb'] = {'current': current // 1024, 'peak': peak // 1024}
+        record.update(extra)
+        listing = bool(self.malloc_top) and self.samples % self.malloc_every == 0
+        self.samples += 1; self.last_sample = now
+        try: self.queue.put_nowait((record, listing))
+        except queue.Full: self.dropped += 1
+
+    def _top_allocators(self, previous):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>")))
+        stats = snapshot.compare_to(previous, "lineno") if previous else snapshot.statistics("lineno")
+        top = [{'where': f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}", 'kb': s.size // 1024,
+                'count': s.count, 'kb_diff': getattr(s, 'size_diff', 0) // 1024} for s in stats[:self.malloc_top]]
+        return top, snapshot
+
+    def _write_loop(self):
+        previous = None
+        while True:
+            item = self.queue.get()
+            if item is None: return
+            record, listing = item
+            if listing and tracemalloc.is_tracing(): record['top_allocators'], previous = self._top_allocators(previous)
+            try: self.sink.write(json.dumps(record, separators=(",", ":")) + "\n"); self.sink.flush()
+            except (OSError, ValueError): self.errors += 1 # Keep draining so the game never waits on a dead sink
+
+    def close(self):
+        """Flushes what is queued, then stops the writer and puts the timed methods back."""
+        self.queue.put(None); self.writer.join(timeout=5)
+        self.astar.uninstall(); self.planner.uninstall()
+        try: self.sink.close()
+        except OSError: pass
+        if self.socket: self.socket.close()
+        if self.own_tracing: tracemalloc.stop()
+
+# --- ENTRY POINTS ---
+def run(args):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy"); os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    from game import GameState, BotPlanner
+    from sessions import RandomWalk
+    telemetry = Telemetry(args.out, args.interval, malloc_every=args.malloc_every, malloc_top=args.top).instrument(GameState, BotPlanner)
+    seed = args.seed; games = 0
+    state = GameState(args.rows, args.mode, endless=args.endless, seed=seed, fog=args.fog); policy = RandomWalk(seed)
+    end = time.perf_counter() + args.minutes * 60
+    try:
+        while time.perf_counter() < end:
+            t0 = time.perf_counter()
+            if args.invincible: state.invincible_timer = max(state.invincible_timer, 1)
+            state.step(policy(state))
+            if not state.game_active or state.game_won:
+                games += 1; seed += 1
+                state = GameState(args.rows, args.mode, endless=args.endless, seed=seed, fog=args.fog); policy = RandomWalk(seed)
+            telemetry.frame(state, time.perf_counter() - t0, games=games)
+    finally: telemetry.close()
+    print(f"{telemetry.samples} samples ({telemetry.dropped} dropped, {telemetry.errors} write errors) over {games} finished games -> {args.out}")
+
+def listen(args):
+    if os.path.exists(args.path): os.remove(args.path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM); server.bind(args.path); server.listen(1)
+    print(f"listening on {args.path}", flush=True)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile("r", encoding="utf-8") as lines:
+                for line in lines: print(line, end="", flush=True)
+    except KeyboardInterrupt: pass
+    finally: server.close(); os.remove(args.path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_p = sub.add_parser("run", help="headless random-walk games at full speed with telemetry on, back to back")
+    run_p.add_argument("--mode", default="hell", choices=["solo", "vs_ai", "hell"])
+    run_p.add_argument("--endless", action="store_true")
+    run_p.add_argument("--fog", action="store_true")
+    run_p.add_argument("--invincible", action="store_true", help="keep one game going instead of restarting on every death")
+    run_p.add_argument("--rows", type=int, default=25)
+    run_p.add_argument("--minutes", type=float, default=1)
+    run_p.add_argument("--out", default="telemetry.ndjson", help="file path or unix:PATH")
+    run_p.add_argument("--interval", type=float, default=1.0, help="seconds between samples")
+    run_p.add_argument("--malloc-every", type=int, default=10, help="list top allocators every N samples")
+    run_p.add_argument("--top", type=int, default=0, help="trace allocations and list this many top allocators; off by default, it slows every allocation")
+    run_p.add_argument("--seed", type=int, default=1)
+    run_p.set_defaults(func=run)
+
+    listen_p = sub.add_parser("listen", help="accept a game's unix:PATH telemetry and print the lines")
+    listen_p.add_argument("path")
+    listen_p.set_defaults(func=listen)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()